@@ -0,0 +1,289 @@
+#!/usr/bin/env python3
+"""
+End-to-end benchmark for the ESP32 MCP server.
+
+Starts simulated devices (simulator/esp32_sim.py), launches the MCP server as a
+subprocess and drives it through a real MCP client over stdio. Every tool call
+goes through the MCP protocol, the server's HTTP transport and the firmware's
+request handling and command queue.
+
+For each tool, device count and concurrency level it reports p50/p95/p99
+latency and calls per second, and saves the results as JSON so runs can be
+compared across commits (--compare).
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import socket
+import subprocess
+import sys
+import time
+import urllib.request
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional
+
+from fastmcp import Client
+from fastmcp.client.transports import PythonStdioTransport
+
+ROOT = os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+SERVER = os.path.join(ROOT, "server", "esp32_mcp_server.py")
+SIMULATOR = os.path.join(ROOT, "simulator", "esp32_sim.py")
+
+# Tool name -> arguments. Effects are kept short so the device queue drains
+# at roughly the rate the benchmark fills it.
+SCENARIOS: Dict[str, Dict[str, Any]] = {
+    "turn_led_on": {},
+    "turn_led_off": {},
+    "get_esp32_status": {},
+    "get_memory_usage": {},
+    "get_telemetry": {},
+    "blink_led": {"count": 1, "interval_ms": 10},
+    "pulse_led": {"speed": 1000, "times": 1},
+    "flash_morse_code": {"message": "E", "dot_duration": 5, "dash_duration": 15,
+                         "element_gap": 5, "letter_gap": 5, "word_gap": 5},
+}
+
+# Firmware overrides so benchmark bursts are measured rather than rejected
+SIM_OVERRIDES = ["QUEUE_SIZE=256", "PRIORITY_QUEUE_SIZE=256", "MAX_CLIENTS=16"]
+
+
+def percentile(sorted_values: List[float], pct: float) -> float:
+    """Linear-interpolated percentile of an already sorted list."""
+    if len(sorted_values) == 1:
+        return sorted_values[0]
+    rank = (len(sorted_values) - 1) * pct / 100
+    low = int(rank)
+    high = min(low + 1, len(sorted_values) - 1)
+    return sorted_values[low] + (sorted_values[high] - sorted_values[low]) * (rank - low)
+
+
+def wait_for_devices(ports: List[int], timeout: float = 30) -> None:
+    """Wait until every simulated device answers /status with an idle command queue."""
+    deadline = time.monotonic() + timeout
+    pending = list(ports)
+    while pending:
+        if time.monotonic() > deadline:
+            raise SystemExit(f"Simulated devices on ports {pending} did not become ready")
+        port = pending[0]
+        try:
+            with urllib.request.urlopen(f"http://127.0.0.1:{port}/status", timeout=2) as response:
+                status = json.load(response)
+            if status.get("queue_length") == 0 and status.get("running_job") is None:
+                pending.pop(0)
+                continue
+        except (OSError, ValueError):
+            pass
+        time.sleep(0.2)
+
+
+def port_is_free(port: int) -> bool:
+    with socket.socket() as s:
+        return s.connect_ex(("127.0.0.1", port)) != 0
+
+
+def start_fleet(args) -> subprocess.Popen:
+    ports = [args.port + i for i in range(max(args.devices))]
+    busy = [p for p in ports if not port_is_free(p)]
+    if busy:
+        raise SystemExit(f"Ports {busy} are already in use")
+    command = [sys.executable, SIMULATOR, "--port", str(args.port), "--devices", str(max(args.devices)), "--quiet"]
+    if args.asyncio:
+        command.append("--asyncio")
+    for item in SIM_OVERRIDES + args.set:
+        command += ["--set", item]
+    fleet = subprocess.Popen(command, stdout=subprocess.DEVNULL)
+    wait_for_devices(ports)
+    return fleet
+
+
+def server_env(args) -> Dict[str, str]:
+    devices = {f"sim{i}": {"ip": "127.0.0.1", "port": args.port + i, "groups": ["sim"], "binary_port": args.port + i}
+               for i in range(max(args.devices))}
+    env = dict(os.environ)
+    env.update({
+        "ESP32_IP": "127.0.0.1",
+        "ESP32_PORT": str(args.port),
+        "ESP32_DEVICES": json.dumps(devices),
+        "MOCK_MODE": "false",
+        "ESP32_TRANSPORT": args.transport,
+    })
+    if args.no_cache:
+        for name in ("STATUS", "MEMORY", "STORAGE", "TELEMETRY"):
+            env[f"ESP32_CACHE_TTL_{name}"] = "0"
+    return env
+
+
+async def run_case(client: Client, tool: str, devices: int, concurrency: int, calls: int) -> Dict[str, Any]:
+    """Make `calls` calls to a tool from `concurrency` workers, spread round-robin over devices."""
+    latencies: List[float] = []
+    errors: Dict[str, int] = {}
+    counter = iter(range(calls))
+
+    async def worker():
+        for i in counter:
+            arguments = dict(SCENARIOS[tool], device=f"sim{i % devices}")
+            started = time.perf_counter()
+            try:
+                result = await client.call_tool(tool, arguments, raise_on_error=False)
+                data = result.data if isinstance(result.data, dict) else {}
+                error = None if not result.is_error and data.get("success", True) else data.get("error", "tool error")
+            except Exception as e:
+                error = str(e) or e.__class__.__name__
+            latencies.append((time.perf_counter() - started) * 1000)
+            if error:
+                errors[error] = errors.get(error, 0) + 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+
+    ordered = sorted(latencies)
+    return {
+        "tool": tool,
+        "devices": devices,
+        "concurrency": concurrency,
+        "calls": len(latencies),
+        "errors": sum(errors.values()),
+        "error_samples": dict(list(errors.items())[:3]),
+        "calls_per_s": round(len(latencies) / elapsed, 1),
+        "latency_ms": {
+            "mean": round(sum(latencies) / len(latencies), 2),
+            "p50": round(percentile(ordered, 50), 2),
+            "p95": round(percentile(ordered, 95), 2),
+            "p99": round(percentile(ordered, 99), 2),
+            "max": round(ordered[-1], 2),
+        },
+    }
+
+
+async def settle(client: Client, devices: int) -> None:
+    """Cancel effects still queued from the previous case so cases do not overlap."""
+    for i in range(devices):
+        await client.call_tool("cancel_command", {"clear_queue": True, "device": f"sim{i}"}, raise_on_error=False)
+
+
+async def run_benchmark(args) -> List[Dict[str, Any]]:
+    transport = PythonStdioTransport(SERVER, env=server_env(args), cwd=ROOT, python_cmd=sys.executable,
+                                     log_file=open(os.devnull, "w"))
+    results = []
+    async with Client(transport) as client:
+        available = {tool.name for tool in await client.list_tools()}
+        tools = [t for t in args.tools if t in available]
+        for skipped in sorted(set(args.tools) - available):
+            print(f"Skipping {skipped}: not provided by the server", file=sys.stderr)
+
+        for tool in tools:
+            for devices in args.devices:
+                for concurrency in args.concurrency:
+                    # Warm up connections and caches before measuring
+                    await run_case(client, tool, devices, concurrency, min(args.calls, concurrency * 2))
+                    await settle(client, devices)
+                    result = await run_case(client, tool, devices, concurrency, args.calls)
+                    await settle(client, devices)
+                    results.append(result)
+                    print_row(result)
+    return results
+
+
+def print_row(result: Dict[str, Any]) -> None:
+    latency = result["latency_ms"]
+    print(f"{result['tool']:<18} {result['devices']:>3} {result['concurrency']:>4} {result['calls']:>6} "
+          f"{result['errors']:>5} {result['calls_per_s']:>9.1f} {latency['p50']:>8.2f} "
+          f"{latency['p95']:>8.2f} {latency['p99']:>8.2f}", flush=True)
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, text=True,
+                                       stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(baseline_path: str, results: List[Dict[str, Any]]) -> None:
+    """Print p50/p95 latency and throughput changes against a saved run."""
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    previous = {(r["tool"], r["devices"], r["concurrency"]): r for r in baseline["results"]}
+    print(f"\nCompared with {baseline_path} (commit {baseline.get('commit')}):")
+    matched = 0
+    for result in results:
+        before = previous.get((result["tool"], result["devices"], result["concurrency"]))
+        if before is None:
+            continue
+        matched += 1
+
+        def change(new, old):
+            return f"{(new - old) / old * 100:+.1f}%" if old else "n/a"
+
+        print(f"{result['tool']:<18} {result['devices']:>3} {result['concurrency']:>4}  "
+              f"p50 {change(result['latency_ms']['p50'], before['latency_ms']['p50']):>8}  "
+              f"p95 {change(result['latency_ms']['p95'], before['latency_ms']['p95']):>8}  "
+              f"calls/s {change(result['calls_per_s'], before['calls_per_s']):>8}")
+    if not matched:
+        print("No cases in common")
+
+
+def int_list(text: str) -> List[int]:
+    return [int(v) for v in text.split(",")]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the ESP32 MCP tools end to end against simulated devices")
+    parser.add_argument("--tools", type=lambda s: s.split(","), default=list(SCENARIOS),
+                        help=f"Comma-separated tools to benchmark (default: {','.join(SCENARIOS)})")
+    parser.add_argument("--devices", type=int_list, default=[1, 4], help="Comma-separated device counts (default: 1,4)")
+    parser.add_argument("--concurrency", type=int_list, default=[1, 4, 16],
+                        help="Comma-separated numbers of concurrent callers (default: 1,4,16)")
+    parser.add_argument("--calls", type=int, default=200, help="Measured calls per case (default: 200)")
+    parser.add_argument("--port", type=int, default=8780, help="First simulated device port (default: 8780)")
+    parser.add_argument("--asyncio", action="store_true", help="Run the firmware in uasyncio server mode")
+    parser.add_argument("--set", action="append", default=[], metavar="NAME=VALUE",
+                        help="Extra firmware constant override passed to the simulator")
+    parser.add_argument("--transport", choices=["http", "binary"], default="http",
+                        help="Transport the server uses for LED commands (default: http)")
+    parser.add_argument("--no-cache", action="store_true", help="Disable the server's read cache")
+    parser.add_argument("--output", help="Write results to this JSON file")
+    parser.add_argument("--compare", help="Compare against a JSON file from a previous run")
+    args = parser.parse_args()
+
+    unknown = set(args.tools) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"Unknown tools: {', '.join(sorted(unknown))}")
+
+    fleet = start_fleet(args)
+    try:
+        print(f"{'tool':<18} {'dev':>3} {'conc':>4} {'calls':>6} {'errs':>5} {'calls/s':>9} "
+              f"{'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+        results = asyncio.run(run_benchmark(args))
+    finally:
+        fleet.terminate()
+        fleet.wait()
+
+    report = {
+        "commit": git_commit(),
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "config": {
+            "firmware_mode": "asyncio" if args.asyncio else "thread",
+            "calls": args.calls,
+            "cache": not args.no_cache,
+            "transport": args.transport,
+            "overrides": SIM_OVERRIDES + args.set,
+        },
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"\nSaved results to {args.output}")
+    if args.compare:
+        compare(args.compare, results)
+
+
+if __name__ == "__main__":
+    main()
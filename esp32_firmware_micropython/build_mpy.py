@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+"""
+Precompile the firmware to MicroPython bytecode for faster boots.
+
+MicroPython always runs main.py from source, so compiling it on the board
+happens on every reset. This script compiles main.py with mpy-cross into
+build/led_server.mpy and writes a one-line build/main.py that imports it;
+the board then loads ready-made bytecode instead of parsing ~1500 lines.
+
+    pip install mpy-cross
+    python build_mpy.py --set 'SSID="my-network"' --set 'PASSWORD="secret"'
+    mpremote cp build/led_server.mpy :led_server.mpy + cp build/main.py :main.py
+
+The mpy-cross version must match the board's MicroPython version
+(mpy-cross==1.25.* for MicroPython v1.25).
+"""
+
+import argparse
+import os
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+STUB = """# Loads the precompiled firmware; built by build_mpy.py
+import {module}
+"""
+
+
+def apply_overrides(source, overrides):
+    """Replace top-level `NAME = value` constants (same syntax as the simulator's --set)."""
+    for item in overrides:
+        name, _, value = item.partition("=")
+        source, count = re.subn(rf"^{name} = [^#\n]*", f"{name} = {value} ", source, count=1, flags=re.M)
+        if not count:
+            raise SystemExit(f"main.py has no top-level constant {name}")
+    return source
+
+
+def find_mpy_cross(path=None):
+    """Command line for mpy-cross: an explicit path, the executable on PATH, or the pip package."""
+    if path:
+        return [path]
+    if shutil.which("mpy-cross"):
+        return ["mpy-cross"]
+    try:
+        import mpy_cross  # noqa: F401
+    except ImportError:
+        raise SystemExit("mpy-cross not found; install it with 'pip install mpy-cross' or pass --mpy-cross")
+    return [sys.executable, "-m", "mpy_cross"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compile main.py to a .mpy module plus a stub main.py")
+    parser.add_argument("--source", default=os.path.join(HERE, "main.py"), help="Firmware source (default: main.py)")
+    parser.add_argument("--output", default=os.path.join(HERE, "build"), help="Output directory (default: build/)")
+    parser.add_argument("--module", default="led_server", help="Name of the compiled module (default: led_server)")
+    parser.add_argument("--march", default="xtensawin", help="Target architecture for native code (default: xtensawin, ESP32)")
+    parser.add_argument("--optimize", type=int, default=2, choices=range(4),
+                        help="mpy-cross -O level; 1+ drops assert statements, 3 also drops line numbers (default: 2)")
+    parser.add_argument("--set", action="append", default=[], metavar="NAME=VALUE",
+                        help="Override a top-level firmware constant before compiling, e.g. --set FAST_BOOT=False")
+    parser.add_argument("--mpy-cross", help="Path to the mpy-cross executable")
+    args = parser.parse_args()
+
+    with open(args.source) as f:
+        source = apply_overrides(f.read(), args.set)
+
+    os.makedirs(args.output, exist_ok=True)
+    target = os.path.join(args.output, args.module + ".mpy")
+    with tempfile.TemporaryDirectory() as tmp:
+        # Compile from a file named after the module so tracebacks point at it
+        staged = os.path.join(tmp, args.module + ".py")
+        with open(staged, "w") as f:
+            f.write(source)
+        command = find_mpy_cross(args.mpy_cross) + [f"-march={args.march}", f"-O{args.optimize}",
+                                                    "-o", target, staged]
+        subprocess.run(command, check=True)
+
+    with open(os.path.join(args.output, "main.py"), "w") as f:
+        f.write(STUB.format(module=args.module))
+
+    print(f"Wrote {target} ({os.path.getsize(target)} bytes, source {len(source.encode())} bytes)")
+    print(f"Wrote {os.path.join(args.output, 'main.py')}")
+    print(f"Upload both, e.g.: mpremote cp {target} :{args.module}.mpy + cp {os.path.join(args.output, 'main.py')} :main.py")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,18 +1,161 @@
 import machine
 import time
 import network
+import gc
+import os
+import json
 import _thread
 import collections
+import array
+import math
+import struct
+
+# Boot milestones in ms since reset. Compiling main.py happens before its first
+# line runs, so 'code_loaded' shows what a precompiled .mpy saves (see build_mpy.py).
+boot_ms = {'code_loaded': time.ticks_ms()}
 
 # WiFi credentials
 SSID = "SSID"
 PASSWORD = "PASSWORD"
 
 # Command queue for LED operations
-cmd_queue = collections.deque((), 20)  # Max 20 commands in queue
+QUEUE_SIZE = 20
+cmd_queue = collections.deque((), QUEUE_SIZE)  # Max 20 (job_id, enqueued_us, cmd) entries
 queue_lock = _thread.allocate_lock()
 queue_running = False
 
+# LED on/off commands go in a small priority lane that is drained before cmd_queue,
+# so they never wait behind a long effect that is still queued
+PRIORITY_QUEUE_SIZE = 4
+priority_queue = collections.deque((), PRIORITY_QUEUE_SIZE)
+
+# (length, size) of the lane that last refused a command, for 429 / queue-full replies
+full_lane = (0, QUEUE_SIZE)
+
+# The running command checks cancel_requested between steps and at least every
+# CANCEL_CHECK_MS while it holds the LED, so /cancel stops it almost at once
+CANCEL_CHECK_MS = 20
+running_job = None
+cancel_requested = False
+
+# Every queued command gets a job ID; the state of every queued or running job, plus the
+# most recent finished ones up to JOB_HISTORY in total, is kept so clients can wait on
+# /jobs/<id> for a command to finish
+JOB_HISTORY = 32
+JOB_MAX_WAIT_MS = 10000  # Longest a /jobs/<id>?wait= request is held open
+JOB_POLL_MS = 20         # How often held /jobs requests re-check their job
+JOB_QUEUED = 'queued'
+JOB_RUNNING = 'running'
+JOB_DONE = 'done'
+JOB_CANCELLED = 'cancelled'
+JOB_FAILED = 'failed'    # The command raised an error while playing
+job_states = {}  # job_id -> JOB_* state
+next_job_id = 0
+
+# Progress of the most recent command (blinks, pulses, Morse characters or timeline steps
+# done out of the total), reported by /status and /jobs/<id>. Kept as plain ints so
+# updating it allocates nothing; it survives until the next command starts, so a finished
+# or cancelled job still reports how far it got.
+progress_job = None
+progress_done = 0
+progress_total = 0
+progress_unit = ''
+
+# Server-sent events: GET /events streams state changes (LED on/off, job queued/running/
+# done/cancelled, new heap low-water marks) to up to MAX_EVENT_CLIENTS subscribers.
+# Events are only built while someone is subscribed; EVENT_BUFFER of them are kept
+# for subscribers that fall behind (who get a fresh state snapshot if they miss any).
+MAX_EVENT_CLIENTS = 2
+EVENT_BUFFER = 32
+EVENT_KEEPALIVE_MS = 15000  # Comment line sent on quiet streams so dead clients are noticed
+HEAP_EVENT_STEP = 1024      # Report a new low-water mark once free heap drops this much further
+events = []                 # (seq, encoded message), oldest first
+event_seq = 0
+event_clients = 0
+event_lock = _thread.allocate_lock()
+heap_low_water = None
+
+def _event_message(seq, kind, data):
+    return 'id: {}\nevent: {}\ndata: {}\n\n'.format(seq, kind, json.dumps(data)).encode('utf-8')
+
+def emit(kind, data):
+    """Publish a state change to /events subscribers (no-op when there are none)"""
+    global event_seq
+    if not event_clients:
+        return
+    with event_lock:
+        event_seq += 1
+        events.append((event_seq, _event_message(event_seq, kind, data)))
+        if len(events) > EVENT_BUFFER:
+            events.pop(0)
+
+def _job_event(job_id, state):
+    emit('job', {"id": job_id, "state": state, "queue_length": queue_length()})
+
+def _check_heap():
+    """Emit a heap event when free memory reaches a new low-water mark"""
+    global heap_low_water
+    free = gc.mem_free()
+    if heap_low_water is None or free <= heap_low_water - HEAP_EVENT_STEP:
+        heap_low_water = free
+        emit('heap', {"free": free, "low_water": free})
+
+# Held while the queue is empty; producers release it to wake the processor,
+# so commands start immediately and the CPU idles between bursts
+queue_wakeup = _thread.allocate_lock()
+queue_wakeup.acquire()
+
+# Enqueue-to-start latency of processed commands (microseconds)
+latency_last_us = 0
+latency_max_us = 0
+latency_total_us = 0
+latency_count = 0
+
+# HTTP server settings
+USE_ASYNCIO = False          # Serve connections and run commands on one uasyncio loop
+HTTP_PORT = 80
+MAX_CLIENTS = 4              # Keep-alive connections held open at once
+KEEPALIVE_IDLE_MS = 15000    # Close persistent connections idle for longer than this
+KEEPALIVE_MAX_REQUESTS = 100 # Requests served per connection before closing it
+MAX_REQUEST_SIZE = 2048      # Upper bound on buffered request headers
+MAX_BODY_SIZE = 4096         # Upper bound on request bodies (e.g. /batch, /timeline)
+
+# Boot: with FAST_BOOT the web server binds as soon as Wi-Fi is up and the self-test
+# is queued like any other command (cancellable via /cancel) instead of played with
+# blocking sleeps before the server starts
+FAST_BOOT = True
+SELF_TEST = True             # Blink, pulse and flash SOS at boot
+WIFI_TIMEOUT_MS = 10000
+WIFI_POLL_MS = 50            # Connection check interval while waiting for Wi-Fi
+
+# UDP discovery: datagrams containing DISCOVERY_MAGIC sent to DISCOVERY_PORT (usually
+# broadcast) are answered with a small JSON announcement of this device's HTTP port
+DISCOVERY_PORT = 4210
+DISCOVERY_MAGIC = b'ESP32-LED-DISCOVER'
+DEVICE_NAME = ''             # Name announced to clients (default: esp32-<last 3 MAC bytes>)
+
+# Binary command protocol: one frame per UDP datagram on BINARY_PORT, skipping HTTP
+# parsing for short commands. Frame: >H length of the rest, B opcode (a CMD_*), H sequence
+# number, packed arguments. Each frame is acknowledged with opcode | BIN_ACK, the same
+# sequence number, a BIN_* status byte and its payload. Replies to the last BINARY_DEDUPE
+# frames are kept so a retransmitted frame is answered again instead of queued twice.
+BINARY_PORT = 4211
+BINARY_MAX_FRAME = 1400      # Fits one Wi-Fi packet; longer timelines go over HTTP
+BINARY_DEDUPE = 8
+BINARY_POLL_MS = 5           # Socket check interval in uasyncio mode
+BIN_ACK = 0x80
+BIN_OK = 0                   # Payload: >I job ID
+BIN_QUEUE_FULL = 1           # Payload: >HH queue length, queue size
+BIN_BAD_REQUEST = 2          # Payload: UTF-8 error message
+
+if USE_ASYNCIO:
+    try:
+        import asyncio
+    except ImportError:
+        import uasyncio as asyncio
+queue_event = None  # asyncio.Event that wakes the async queue processor
+async_clients = 0   # Connections currently served by the asyncio server
+
 # Thread tracking
 active_threads = set()
 thread_counter = 0
@@ -62,6 +205,19 @@ led_pwm = machine.PWM(led_pin, freq=1000)  # 1kHz PWM frequency
 led_pwm.duty(0)  # Start with LED off
 led_state = False
 
+# Waveform engine: a hardware timer plays a duty lookup table at a fixed sample
+# rate, so effects like pulse are smooth and independent of interpreter timing
+WAVE_TIMER_ID = 0
+WAVE_RATE_HZ = 100       # Samples per second
+WAVE_GAMMA = 2.2         # Gamma correction for perceived brightness
+WAVE_MAX_SAMPLES = 2048  # Upper bound on lookup table length
+wave_timer = machine.Timer(WAVE_TIMER_ID)
+wave_lut = None          # array('H') of duty values being played
+wave_index = 0
+wave_remaining = 0       # Samples left to play
+_lut_cache_key = None
+_lut_cache = None
+
 def set_led(on):
     """Turn LED on or off"""
     global led_state
@@ -74,6 +230,240 @@ CMD_LED_OFF = 2
 CMD_MORSE = 3
 CMD_BLINK = 4
 CMD_PULSE = 5
+CMD_TIMELINE = 6
+
+def _forget_finished_job():
+    """Drop the oldest finished job from job_states; queued and running jobs are never dropped.
+    
+    Returns False if every tracked job is unfinished. Caller must hold queue_lock.
+    """
+    oldest = None
+    for job_id in job_states:
+        if job_states[job_id] not in (JOB_QUEUED, JOB_RUNNING) and (oldest is None or job_id < oldest):
+            oldest = job_id
+    if oldest is None:
+        return False
+    del job_states[oldest]
+    return True
+
+def _enqueue(cmd, lane=cmd_queue):
+    """Append a command to a queue lane and return its job ID; caller must hold queue_lock"""
+    global next_job_id
+    next_job_id += 1
+    job_states[next_job_id] = JOB_QUEUED
+    while len(job_states) > JOB_HISTORY and _forget_finished_job():
+        pass
+    lane.append((next_job_id, time.ticks_us(), cmd))
+    _job_event(next_job_id, JOB_QUEUED)
+    return next_job_id
+
+def _submit(cmd):
+    """Queue one command and wake the processor; returns its job ID, or None if its lane is full"""
+    global full_lane
+    if cmd[0] in (CMD_LED_ON, CMD_LED_OFF):
+        lane, size = priority_queue, PRIORITY_QUEUE_SIZE
+    else:
+        lane, size = cmd_queue, QUEUE_SIZE
+    with queue_lock:
+        if len(lane) >= size:
+            full_lane = (len(lane), size)
+            return None
+        job_id = _enqueue(cmd, lane)
+    _wake_queue()
+    return job_id
+
+def queue_length():
+    """Commands waiting in both lanes"""
+    return len(priority_queue) + len(cmd_queue)
+
+def _progress_start(total, unit):
+    """Start progress counting for the running command"""
+    global progress_job, progress_done, progress_total, progress_unit
+    progress_job, progress_done, progress_total, progress_unit = running_job, 0, total, unit
+
+def job_progress(job_id):
+    """Progress of a job as a dict, or None if it is not the most recent command"""
+    if progress_job is None or progress_job != job_id:
+        return None
+    return {"done": progress_done, "total": progress_total, "unit": progress_unit}
+
+def _next_command():
+    """Pop the next entry (priority lane first) and mark it running, or return None if idle"""
+    global running_job, cancel_requested
+    with queue_lock:
+        if len(priority_queue) > 0:
+            entry = priority_queue.popleft()
+        elif len(cmd_queue) > 0:
+            entry = cmd_queue.popleft()
+        else:
+            return None
+        running_job = entry[0]
+        cancel_requested = False
+        if entry[0] in job_states:
+            job_states[entry[0]] = JOB_RUNNING
+        _job_event(entry[0], JOB_RUNNING)
+    _record_latency(entry[1])
+    return entry
+
+def _finish_command(entry, failed=False):
+    """Record a command's outcome; a cancelled or failed effect is stopped and the LED restored"""
+    global running_job
+    if failed:
+        state = JOB_FAILED
+    elif cancel_requested:
+        state = JOB_CANCELLED
+    else:
+        state = JOB_DONE
+    if state != JOB_DONE:
+        wave_stop()
+        led_pwm.duty(1023 if led_state else 0)
+    with queue_lock:
+        running_job = None
+        if entry[0] in job_states:
+            job_states[entry[0]] = state
+        _job_event(entry[0], state)
+    _check_heap()
+
+def _drop_queued(job_id=None):
+    """Remove queued commands (all, or just job_id) and mark them cancelled; caller holds queue_lock"""
+    dropped = 0
+    for lane in (priority_queue, cmd_queue):
+        kept = []
+        while len(lane) > 0:
+            entry = lane.popleft()
+            if job_id is None or entry[0] == job_id:
+                if entry[0] in job_states:
+                    job_states[entry[0]] = JOB_CANCELLED
+                _job_event(entry[0], JOB_CANCELLED)
+                dropped += 1
+            else:
+                kept.append(entry)
+        for entry in kept:
+            lane.append(entry)
+    return dropped
+
+def clear_queue():
+    """Drop every command that has not started yet; returns how many were dropped"""
+    with queue_lock:
+        return _drop_queued()
+
+def cancel_command(job_id=None, clear=False):
+    """Stop the running command (or only job_id, whether running or queued)
+    
+    Returns (cancelled running job ID or None, number of queued commands dropped).
+    """
+    global cancel_requested
+    with queue_lock:
+        cancelled = None
+        if running_job is not None and job_id in (None, running_job):
+            cancel_requested = True
+            cancelled = running_job
+        if job_id is not None and cancelled is None:
+            dropped = _drop_queued(job_id)
+        else:
+            dropped = _drop_queued() if clear else 0
+    return cancelled, dropped
+
+def job_state(job_id):
+    """State of a job, JOB_DONE for finished jobs too old to be tracked, or None if it never existed"""
+    with queue_lock:
+        if job_id in job_states:
+            return job_states[job_id]
+        if 0 < job_id <= next_job_id:
+            return JOB_DONE
+    return None
+
+def _wake_queue():
+    """Wake the queue processor if it is waiting for work"""
+    if queue_event is not None:
+        queue_event.set()
+    elif queue_wakeup.locked():
+        try:
+            queue_wakeup.release()
+        except RuntimeError:
+            pass  # Another producer released it first
+
+def _record_latency(enqueued_us):
+    """Track how long a command waited in the queue before starting"""
+    global latency_last_us, latency_max_us, latency_total_us, latency_count
+    waited = time.ticks_diff(time.ticks_us(), enqueued_us)
+    latency_last_us = waited
+    latency_total_us += waited
+    latency_count += 1
+    if waited > latency_max_us:
+        latency_max_us = waited
+
+def command_steps(cmd):
+    """Start a queued command; returns its step generator, or None if it completed at once"""
+    cmd_type = cmd[0]
+    
+    if cmd_type == CMD_LED_ON:
+        print("Processing: LED ON")
+        _set_led_direct(True)
+    
+    elif cmd_type == CMD_LED_OFF:
+        print("Processing: LED OFF")
+        _set_led_direct(False)
+    
+    elif cmd_type == CMD_MORSE:
+        print("Processing: Morse Code")
+        text, params = cmd[1], cmd[2]
+        return _morse_steps(
+            text, 
+            params.get('dot_duration', 100),
+            params.get('dash_duration', 300),
+            params.get('element_gap', 100),
+            params.get('letter_gap', 300),
+            params.get('word_gap', 700)
+        )
+    
+    elif cmd_type == CMD_BLINK:
+        print("Processing: Blink")
+        count, interval = cmd[1], cmd[2]
+        return _blink_steps(count, interval)
+    
+    elif cmd_type == CMD_PULSE:
+        print("Processing: Pulse")
+        speed, min_duty, max_duty, times = cmd[1], cmd[2], cmd[3], cmd[4]
+        return _pulse_steps(speed, min_duty, max_duty, times)
+    
+    elif cmd_type == CMD_TIMELINE:
+        print("Processing: Timeline")
+        return _timeline_steps(cmd[1], cmd[2])
+    
+    return None
+
+def _play(steps):
+    """Run an effect's steps, sleeping for each hold time it yields; stops early if cancelled"""
+    if steps is None:
+        return
+    for hold_ms in steps:
+        end = time.ticks_add(time.ticks_ms(), hold_ms)
+        while not cancel_requested:
+            left = time.ticks_diff(end, time.ticks_ms())
+            if left <= 0:
+                break
+            time.sleep_ms(min(left, CANCEL_CHECK_MS))
+        if cancel_requested:
+            return
+
+async def _play_async(steps):
+    """Run an effect's steps without blocking the event loop; stops early if cancelled"""
+    if steps is None:
+        return
+    for hold_ms in steps:
+        end = time.ticks_add(time.ticks_ms(), hold_ms)
+        while not cancel_requested:
+            left = time.ticks_diff(end, time.ticks_ms())
+            if left <= 0:
+                break
+            await asyncio.sleep_ms(min(left, CANCEL_CHECK_MS))
+        if cancel_requested:
+            return
+
+def run_command(cmd):
+    """Execute a single queued command to completion"""
+    _play(command_steps(cmd))
 
 def process_queue_thread():
     """Thread function to process the command queue"""
@@ -83,76 +473,78 @@ def process_queue_thread():
     queue_running = True
     
     while True:
-        # Check if there are commands in the queue
-        if len(cmd_queue) > 0:
-            # Get command from queue with thread safety
-            with queue_lock:
-                if len(cmd_queue) > 0:  # Check again inside lock
-                    cmd = cmd_queue.popleft()
-                else:
-                    continue
-            
-            # Process the command
-            cmd_type = cmd[0]
-            
-            if cmd_type == CMD_LED_ON:
-                print("Processing: LED ON")
-                _set_led_direct(True)
-            
-            elif cmd_type == CMD_LED_OFF:
-                print("Processing: LED OFF")
-                _set_led_direct(False)
-            
-            elif cmd_type == CMD_MORSE:
-                print("Processing: Morse Code")
-                text, params = cmd[1], cmd[2]
-                _flash_morse_code_direct(
-                    text, 
-                    params.get('dot_duration', 100),
-                    params.get('dash_duration', 300),
-                    params.get('element_gap', 100),
-                    params.get('letter_gap', 300),
-                    params.get('word_gap', 700)
-                )
-            
-            elif cmd_type == CMD_BLINK:
-                print("Processing: Blink")
-                count, interval = cmd[1], cmd[2]
-                _blink_led_direct(count, interval)
-            
-            elif cmd_type == CMD_PULSE:
-                print("Processing: Pulse")
-                speed, min_duty, max_duty, times = cmd[1], cmd[2], cmd[3], cmd[4]
-                _pulse_led_direct(speed, min_duty, max_duty, times)
+        # Get command from queue with thread safety
+        entry = _next_command()
         
-        # Small delay to prevent tight loop
-        time.sleep_ms(10)
+        if entry is None:
+            # Block until a producer queues something
+            queue_wakeup.acquire()
+            continue
+        
+        # A failing command fails its own job; the processor keeps going
+        try:
+            run_command(entry[2])
+        except Exception as e:
+            print('Command failed:', e)
+            _finish_command(entry, failed=True)
+            continue
+        _finish_command(entry)
+
+async def process_queue_async():
+    """Process the command queue as a task on the uasyncio loop"""
+    global queue_running
+    
+    print("Command queue processor started (asyncio)")
+    queue_running = True
+    
+    while True:
+        entry = _next_command()
+        
+        if entry is None:
+            # Wait until a request handler queues something
+            await queue_event.wait()
+            queue_event.clear()
+            continue
+        
+        try:
+            await _play_async(command_steps(entry[2]))
+        except Exception as e:
+            print('Command failed:', e)
+            _finish_command(entry, failed=True)
+            continue
+        _finish_command(entry)
 
 def _set_led_direct(on):
     """Direct LED control without queuing"""
     global led_state
     led_state = on
     led_pwm.duty(1023 if on else 0)
+    emit('led', {"state": on})
 
 def set_led(on):
-    """Queue an LED on/off command"""
-    with queue_lock:
-        cmd_queue.append((CMD_LED_ON if on else CMD_LED_OFF,))
-    return True
+    """Queue an LED on/off command; returns its job ID (None if the queue is full)"""
+    return _submit((CMD_LED_ON if on else CMD_LED_OFF,))
 
 def _flash_morse_code_direct(text, dot_duration=100, dash_duration=300, 
                           element_gap=100, letter_gap=300, word_gap=700):
     """Direct Morse code flashing without queuing"""
+    _play(_morse_steps(text, dot_duration, dash_duration, element_gap, letter_gap, word_gap))
+
+def _morse_steps(text, dot_duration, dash_duration, element_gap, letter_gap, word_gap):
+    """Morse code effect: drives the LED and yields each hold time in ms"""
     print("Flashing Morse code:", text)
     # Convert text to uppercase since our dictionary uses uppercase keys
+    global progress_done
     text = text.upper()
+    _progress_start(len(text), 'characters')
     
-    for char in text:
+    for n, char in enumerate(text):
+        progress_done = n
         print("Processing character:", char)
         if char == ' ':
             # Gap between words
             print("Word gap:", word_gap, "ms")
-            time.sleep_ms(word_gap)
+            yield word_gap
             continue
             
         if char in MORSE_CODE_DICT:
@@ -164,24 +556,25 @@ def _flash_morse_code_direct(text, dot_duration=100, dash_duration=300,
                 print(" " + element, end='')
                 led_pwm.duty(1023)  # Turn on LED
                 if element == '.':
-                    time.sleep_ms(dot_duration)
+                    yield dot_duration
                 else:  # dash
-                    time.sleep_ms(dash_duration)
+                    yield dash_duration
                 led_pwm.duty(0)  # Turn off LED
                 if i < len(code) - 1:  # Don't add gap after last element
-                    time.sleep_ms(element_gap)
+                    yield element_gap
             print()  # New line after each character
             
             # Gap between letters
-            time.sleep_ms(letter_gap)
+            yield letter_gap
     
     # Ensure LED is off after finishing
     led_pwm.duty(0)
+    progress_done = len(text)
     print("Morse code complete")
 
 def flash_morse_code(text, dot_duration=100, dash_duration=300, 
                    element_gap=100, letter_gap=300, word_gap=700):
-    """Queue a Morse code command"""
+    """Queue a Morse code command; returns its job ID (None if the queue is full)"""
     params = {
         'dot_duration': dot_duration,
         'dash_duration': dash_duration,
@@ -190,26 +583,98 @@ def flash_morse_code(text, dot_duration=100, dash_duration=300,
         'word_gap': word_gap
     }
     
-    with queue_lock:
-        cmd_queue.append((CMD_MORSE, text, params))
+    return _submit((CMD_MORSE, text, params))
+
+def _timeline_steps(timeline, on_duty=1023):
+    """Play a packed timeline of little-endian uint16 hold times (ms), alternating LED on/off
     
-    return True
+    Reads the buffer in place and prints nothing, so playback does no per-element
+    allocation or UART output that would add jitter.
+    """
+    global progress_done
+    _progress_start(len(timeline) // 2, 'steps')
+    on = True
+    for i in range(0, len(timeline) - 1, 2):
+        led_pwm.duty(on_duty if on else 0)
+        yield timeline[i] | (timeline[i + 1] << 8)
+        progress_done += 1
+        on = not on
+    led_pwm.duty(0)
+
+def play_timeline(timeline, on_duty=1023):
+    """Queue a packed on/off timeline; returns its job ID (None if the queue is full)"""
+    return _submit((CMD_TIMELINE, timeline, on_duty))
+
+def breathing_lut(speed, min_duty, max_duty):
+    """Gamma-corrected breathing curve (one fade in and out) sampled at WAVE_RATE_HZ
+    
+    The period matches the original stepped pulse: (max - min) / speed steps of
+    10 ms in each direction. The last table is cached for repeated pulses.
+    """
+    global _lut_cache_key, _lut_cache
+    if max_duty < min_duty:
+        min_duty, max_duty = max_duty, min_duty
+    key = (speed, min_duty, max_duty)
+    if key == _lut_cache_key:
+        return _lut_cache
+    
+    steps = max(1, -(-(max_duty - min_duty) // max(1, speed)))  # ceil division
+    samples = min(WAVE_MAX_SAMPLES, max(2, 2 * steps * 10 * WAVE_RATE_HZ // 1000))
+    span = max_duty - min_duty
+    lut = array.array('H', [0] * samples)
+    for i in range(samples):
+        level = (1 - math.cos(2 * math.pi * i / samples)) / 2
+        lut[i] = min_duty + int(span * level ** WAVE_GAMMA + 0.5)
+    
+    _lut_cache_key, _lut_cache = key, lut
+    return lut
+
+def _wave_tick(timer):
+    """Timer callback: output the next lookup table sample (no allocation)"""
+    global wave_index, wave_remaining
+    if wave_remaining <= 0:
+        timer.deinit()
+        led_pwm.duty(0)
+        return
+    led_pwm.duty(wave_lut[wave_index])
+    wave_index += 1
+    if wave_index >= len(wave_lut):
+        wave_index = 0
+    wave_remaining -= 1
+
+def wave_start(lut, repeats=1):
+    """Play a duty lookup table `repeats` times on the waveform timer"""
+    global wave_lut, wave_index, wave_remaining
+    wave_timer.deinit()
+    wave_lut, wave_index, wave_remaining = lut, 0, len(lut) * repeats
+    wave_timer.init(mode=machine.Timer.PERIODIC, period=1000 // WAVE_RATE_HZ, callback=_wave_tick)
+
+def wave_stop():
+    """Stop the waveform timer immediately"""
+    global wave_remaining
+    wave_remaining = 0
+    wave_timer.deinit()
 
 def _pulse_led_direct(speed=20, min_duty=0, max_duty=1023, times=1):
     """Direct LED pulsing without queuing"""
-    for _ in range(times):
-        # Fade in
-        for duty in range(min_duty, max_duty, speed):
-            led_pwm.duty(duty)
-            time.sleep_ms(10)
-        # Fade out
-        for duty in range(max_duty, min_duty, -speed):
-            led_pwm.duty(duty)
-            time.sleep_ms(10)
+    _play(_pulse_steps(speed, min_duty, max_duty, times))
+
+def _pulse_steps(speed, min_duty, max_duty, times):
+    """Pulse effect: the waveform timer drives the LED; this just waits for it to finish"""
+    global progress_done
+    lut = breathing_lut(speed, min_duty, max_duty)
+    samples = len(lut)
+    _progress_start(times, 'pulses')
+    wave_start(lut, times)
+    # Wake at each pulse boundary to count finished pulses
+    while wave_remaining > 0:
+        progress_done = times - (wave_remaining + samples - 1) // samples
+        yield max(10, (wave_remaining % samples or samples) * 1000 // WAVE_RATE_HZ)
+    progress_done = times
     led_pwm.duty(0)  # Turn off after pulsing
 
 def pulse_led(speed=20, min_duty=0, max_duty=1023, times=1):
-    """Queue an LED pulse command
+    """Queue an LED pulse command; returns its job ID (None if the queue is full)
     
     Args:
         speed: Controls the speed of the pulse (lower is faster)
@@ -217,17 +682,22 @@ def pulse_led(speed=20, min_duty=0, max_duty=1023, times=1):
         max_duty: Maximum brightness (0-1023)
         times: Number of times to repeat the pulse
     """
-    with queue_lock:
-        cmd_queue.append((CMD_PULSE, speed, min_duty, max_duty, times))
-    return True
+    return _submit((CMD_PULSE, speed, min_duty, max_duty, times))
 
 def _blink_led_direct(count=3, interval_ms=200):
     """Direct LED blinking without queuing"""
+    _play(_blink_steps(count, interval_ms))
+
+def _blink_steps(count, interval_ms):
+    """Blink effect: drives the LED and yields each hold time in ms"""
+    global progress_done
+    _progress_start(count, 'blinks')
     for _ in range(count):
         led_pwm.duty(1023)  # On
-        time.sleep_ms(interval_ms // 2)
+        yield interval_ms // 2
         led_pwm.duty(0)     # Off
-        time.sleep_ms(interval_ms // 2)
+        yield interval_ms // 2
+        progress_done += 1
     
     # Restore previous state
     if led_state:
@@ -236,17 +706,78 @@ def _blink_led_direct(count=3, interval_ms=200):
         led_pwm.duty(0)
 
 def blink_led(count=3, interval_ms=200):
-    """Queue an LED blink command
+    """Queue an LED blink command; returns its job ID (None if the queue is full)
     
     Args:
         count: Number of times to blink
         interval_ms: Duration of each blink in milliseconds
     """
+    return _submit((CMD_BLINK, count, interval_ms))
+
+# Arguments (after the command type) accepted for each batched command: an inclusive
+# (min, max) range for integers, or the type of any other argument
+UINT16 = (0, 0xFFFF)
+DUTY = (0, 1023)
+BATCH_ARGS = {
+    CMD_LED_ON: (),
+    CMD_LED_OFF: (),
+    CMD_MORSE: (str, dict),
+    CMD_BLINK: (UINT16, UINT16),
+    CMD_PULSE: (UINT16, DUTY, DUTY, UINT16),
+}
+MORSE_PARAMS = ('dot_duration', 'dash_duration', 'element_gap', 'letter_gap', 'word_gap')
+
+def _valid_int(value, bounds):
+    # bool is an int subclass, but true/false are not counts or durations
+    return type(value) is int and bounds[0] <= value <= bounds[1]
+
+def parse_batch(commands):
+    """Validate a list of [CMD_*, args...] lists and convert them to queue tuples"""
+    batch = []
+    for cmd in commands:
+        if not isinstance(cmd, list) or not cmd or cmd[0] not in BATCH_ARGS:
+            raise ValueError('Invalid command: ' + str(cmd))
+        spec = BATCH_ARGS[cmd[0]]
+        if len(cmd) != len(spec) + 1:
+            raise ValueError('Invalid command: ' + str(cmd))
+        for value, kind in zip(cmd[1:], spec):
+            if isinstance(kind, tuple):
+                valid = _valid_int(value, kind)
+            else:
+                valid = isinstance(value, kind)
+            if not valid:
+                raise ValueError('Invalid argument {} in {}'.format(repr(value), cmd))
+        if cmd[0] == CMD_MORSE:
+            for name in MORSE_PARAMS:
+                if name in cmd[2] and not _valid_int(cmd[2][name], UINT16):
+                    raise ValueError('Morse ' + name + ' must be an integer from 0 to 65535')
+        batch.append(tuple(cmd))
+    return batch
+
+def enqueue_batch(batch):
+    """Atomically append a list of commands so they run back to back.
+    
+    Returns their job IDs, or None without queuing anything if the whole batch does not fit.
+    """
+    global full_lane
     with queue_lock:
-        cmd_queue.append((CMD_BLINK, count, interval_ms))
-    return True
+        if len(cmd_queue) + len(batch) > QUEUE_SIZE:
+            full_lane = (len(cmd_queue), QUEUE_SIZE)
+            return None
+        job_ids = [_enqueue(cmd) for cmd in batch]
+    _wake_queue()
+    return job_ids
+
+# Station interface, created once by connect_wifi() and reused by the status routes
+wlan = None
+
+def boot_phase(name):
+    """Record a boot milestone (ms since reset) for /status"""
+    boot_ms[name] = time.ticks_ms()
+    print('Boot:', name, 'at', boot_ms[name], 'ms')
 
 def connect_wifi():
+    global wlan
     wlan = network.WLAN(network.STA_IF)
     wlan.active(True)
     
@@ -254,13 +785,12 @@ def connect_wifi():
         print('Connecting to network...')
         wlan.connect(SSID, PASSWORD)
         
-        # Wait for connection with timeout
-        timeout = 0
-        while not wlan.isconnected() and timeout < 20:  # 10 second timeout
-            print('Waiting for connection...')
-            time.sleep(0.5)
-            timeout += 1
+        # Poll often so the server can start as soon as the link is up
+        started = time.ticks_ms()
+        while not wlan.isconnected() and time.ticks_diff(time.ticks_ms(), started) < WIFI_TIMEOUT_MS:
+            time.sleep_ms(WIFI_POLL_MS)
     
+    boot_phase('wifi_connected')
     if wlan.isconnected():
         print('Network config:', wlan.ifconfig())
         return wlan.ifconfig()[0]
@@ -268,191 +798,893 @@ def connect_wifi():
         print('Failed to connect to WiFi')
         return None
 
+HEX_DIGITS = '0123456789abcdefABCDEF'
+
+def url_decode(text):
+    """Decode '+' and %XX escapes (including multi-byte UTF-8) in a URL component"""
+    if '%' not in text:
+        return text.replace('+', ' ')
+    parts = text.replace('+', ' ').split('%')
+    out = bytearray(parts[0].encode('utf-8'))
+    for part in parts[1:]:
+        if len(part) >= 2 and part[0] in HEX_DIGITS and part[1] in HEX_DIGITS:
+            out.append(int(part[:2], 16))
+            out.extend(part[2:].encode('utf-8'))
+        else:
+            out.extend(b'%' + part.encode('utf-8'))  # Not an escape, keep it literally
+    return out.decode('utf-8')
+
+class Request:
+    """A parsed HTTP request: method, path, decoded query parameters, headers and body"""
+    
+    def __init__(self, method, path, version, query, headers):
+        self.method = method
+        self.path = path
+        self.version = version
+        self.query = query
+        self.headers = headers
+        self.body = b''
+    
+    def content_length(self):
+        try:
+            return int(self.headers.get('content-length', 0))
+        except ValueError:
+            return 0
+    
+    def keep_alive(self):
+        """HTTP/1.1 defaults to persistent connections unless the client opts out"""
+        connection = self.headers.get('connection', '').lower()
+        if connection == 'close':
+            return False
+        return connection == 'keep-alive' or self.version == 'HTTP/1.1'
+    
+    def int_param(self, name, default):
+        """Integer query parameter; raises ValueError if present but not a number"""
+        value = self.query.get(name)
+        if value is None or value == '':
+            return default
+        try:
+            return int(value)
+        except ValueError:
+            raise ValueError('Invalid value for ' + name)
+
+def parse_request(head):
+    """Parse the request line, query string and headers of a request head in one pass"""
+    lines = head.split('\r\n')
+    parts = lines[0].split(' ')
+    if len(parts) != 3:
+        raise ValueError('Malformed request line')
+    method, target, version = parts
+    
+    query = {}
+    qmark = target.find('?')
+    if qmark != -1:
+        for pair in target[qmark + 1:].split('&'):
+            eq = pair.find('=')
+            if eq == -1:
+                query[url_decode(pair)] = ''
+            else:
+                query[url_decode(pair[:eq])] = url_decode(pair[eq + 1:])
+        target = target[:qmark]
+    
+    headers = {}
+    for line in lines[1:]:
+        colon = line.find(':')
+        if colon > 0:
+            headers[line[:colon].strip().lower()] = line[colon + 1:].strip()
+    
+    return Request(method, url_decode(target), version, query, headers)
+
+restart_requested = False  # Set by /restart; the server resets after responding
+
+def queue_full_response():
+    """429 response telling the client how full the refusing lane is"""
+    body = json.dumps({"error": "Queue full", "queue_length": full_lane[0], "queue_size": full_lane[1]})
+    return ('429 Too Many Requests', 'application/json', body, {'Retry-After': '1'})
+
+def queued_response(job_ids, message):
+    """Response for queued command(s): job IDs in the X-Job-Id header, or 429 if nothing was queued"""
+    if job_ids is None:
+        return queue_full_response()
+    if isinstance(job_ids, int):
+        job_ids = [job_ids]
+    return ('200 OK', 'text/plain', message, {'X-Job-Id': ','.join(str(j) for j in job_ids)})
+
+def route_led_on(req):
+    return queued_response(set_led(True), 'LED ON')
+
+def route_led_off(req):
+    return queued_response(set_led(False), 'LED OFF')
+
+def route_led_blink(req):
+    job_id = blink_led(req.int_param('count', 3), req.int_param('interval', 200))
+    return queued_response(job_id, 'Blink queued')
+
+def route_led_pulse(req):
+    job_id = pulse_led(
+        req.int_param('speed', 20),
+        req.int_param('min', 0),
+        req.int_param('max', 1023),
+        req.int_param('times', 1)
+    )
+    return queued_response(job_id, 'Pulse queued')
+
+def route_morse(req):
+    message = req.query.get('message')
+    if not message:
+        return ('400 Bad Request', 'text/plain', 'Missing message parameter')
+    
+    # Queue the Morse code command (non-blocking)
+    job_id = flash_morse_code(
+        message,
+        dot_duration=req.int_param('dot', 100),
+        dash_duration=req.int_param('dash', 300),
+        element_gap=req.int_param('element_gap', 100),
+        letter_gap=req.int_param('letter_gap', 300),
+        word_gap=req.int_param('word_gap', 700)
+    )
+    return queued_response(job_id, 'Morse code queued')
+
+def route_timeline(req):
+    # Play a precompiled on/off timeline (e.g. Morse code compiled by the MCP server)
+    if not req.body or len(req.body) % 2:
+        return ('400 Bad Request', 'text/plain', 'Timeline must be a non-empty list of uint16 values')
+    job_id = play_timeline(req.body, req.int_param('duty', 1023))
+    return queued_response(job_id, 'Timeline queued')
+
+def route_batch(req):
+    # Queue a whole sequence of commands in one round trip
+    try:
+        batch = parse_batch(json.loads(req.body)['commands'])
+    except Exception as e:
+        return ('400 Bad Request', 'text/plain', 'Invalid batch: ' + str(e))
+    return queued_response(enqueue_batch(batch), 'Queued {} commands'.format(len(batch)))
+
+def _job_json(job_id, state):
+    job = {"id": job_id, "state": state}
+    if state == JOB_QUEUED:
+        with queue_lock:
+            ids = [entry[0] for entry in priority_queue] + [entry[0] for entry in cmd_queue]
+        if job_id in ids:
+            job["position"] = ids.index(job_id)
+    progress = job_progress(job_id)
+    if progress is not None:
+        job["progress"] = progress
+    return ('200 OK', 'application/json', json.dumps(job))
+
+def route_job(req):
+    # /jobs/<id>?wait=<ms>[&since=<n>]: report a job's state, holding the request open
+    # until it finishes or the wait expires. With since, also answer as soon as the job
+    # is running with more than n units of progress done (since=-1: once it starts).
+    try:
+        job_id = int(req.path[len('/jobs/'):])
+    except ValueError:
+        return ('400 Bad Request', 'text/plain', 'Invalid job ID')
+    if job_state(job_id) is None:
+        return ('404 Not Found', 'text/plain', 'Unknown job')
+    
+    deadline = time.ticks_add(time.ticks_ms(), min(max(0, req.int_param('wait', 0)), JOB_MAX_WAIT_MS))
+    since = req.int_param('since', None)
+    
+    def poll():
+        state = job_state(job_id)
+        if state in (JOB_DONE, JOB_CANCELLED, JOB_FAILED) or time.ticks_diff(deadline, time.ticks_ms()) <= 0:
+            return _job_json(job_id, state)
+        if since is not None and state == JOB_RUNNING:
+            progress = job_progress(job_id)
+            if since < 0 or (progress is not None and progress["done"] > since):
+                return _job_json(job_id, state)
+        return None
+    
+    # A callable result is a long-poll: the server calls it until it returns a response
+    return poll() or poll
+
+def state_snapshot():
+    """Current state sent to a new /events subscriber before any change events"""
+    with queue_lock:
+        current_job = running_job
+        waiting = queue_length()
+    return {
+        "name": device_name(),
+        "led_state": led_state,
+        "running_job": current_job,
+        "queue_length": waiting,
+        "heap_free": gc.mem_free(),
+        "heap_low_water": heap_low_water
+    }
+
+EVENT_STREAM_HEADER = (b'HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\n'
+                       b'Cache-Control: no-cache\r\nConnection: keep-alive\r\n\r\n')
+
+class EventStream:
+    """An open /events connection and the last event sequence number it was sent"""
+    
+    def __init__(self):
+        self.seq = None
+        self.last_ms = time.ticks_ms()
+    
+    def pending(self):
+        """Bytes due on the stream: a snapshot first (or after missing events), then new events"""
+        with event_lock:
+            missed = self.seq is None or event_seq - self.seq > len(events)
+            if missed:
+                self.seq = event_seq
+            else:
+                data = b''.join([entry[1] for entry in events if entry[0] > self.seq])
+                self.seq = event_seq
+        if missed:
+            # Built outside event_lock: emit() may be called with queue_lock held
+            data = _event_message(self.seq, 'state', state_snapshot())
+        now = time.ticks_ms()
+        if data:
+            self.last_ms = now
+            return data
+        if time.ticks_diff(now, self.last_ms) >= EVENT_KEEPALIVE_MS:
+            self.last_ms = now
+            return b': keep-alive\n\n'
+        return None
+
+def route_events(req):
+    # /events: the server turns this connection into a text/event-stream
+    if event_clients >= MAX_EVENT_CLIENTS:
+        return ('503 Service Unavailable', 'text/plain', 'Too many event subscribers')
+    return EventStream()
+
+# Filesystem stats rarely change, so statvfs results are reused for STORAGE_CACHE_MS
+STORAGE_CACHE_MS = 60000
+storage_cache = None
+storage_cache_ms = 0
+
+def storage_stats():
+    """Filesystem usage of '/', served from cache while fresh"""
+    global storage_cache, storage_cache_ms
+    now = time.ticks_ms()
+    if storage_cache is not None and time.ticks_diff(now, storage_cache_ms) < STORAGE_CACHE_MS:
+        return storage_cache
+    
+    fs_stat = os.statvfs('/')
+    block_size = fs_stat[0]
+    total_blocks = fs_stat[2]
+    free_blocks = fs_stat[3]
+    
+    total_space = block_size * total_blocks
+    free_space = block_size * free_blocks
+    used_space = total_space - free_space
+    
+    storage_cache = {
+        "total_bytes": total_space,
+        "used_bytes": used_space,
+        "free_bytes": free_space,
+        "used_percent": round((used_space / total_space) * 100, 1) if total_space > 0 else 0
+    }
+    storage_cache_ms = now
+    return storage_cache
+
+def memory_stats(collect):
+    """Heap usage; collect=True runs gc.collect() first for exact numbers"""
+    if collect:
+        gc.collect()
+    
+    free = gc.mem_free()
+    allocated = gc.mem_alloc()
+    total = free + allocated
+    
+    # Calculate fragmentation
+    # Higher fragmentation means memory is more scattered
+    fragmentation = 0
+    if total > 0:
+        fragmentation = round((1 - (free / total)) * 100, 1)
+    
+    return {
+        "free": free,
+        "allocated": allocated,
+        "total": total,
+        "free_percent": round((free / total) * 100, 1) if total > 0 else 0,
+        "fragmentation": fragmentation,
+        "collected": collect
+    }
+
+def device_name():
+    """DEVICE_NAME, or a name derived from the station MAC address"""
+    if DEVICE_NAME:
+        return DEVICE_NAME
+    try:
+        return 'esp32-' + ''.join('{:02x}'.format(b) for b in wlan.config('mac')[-3:])
+    except Exception:
+        return 'esp32-' + str(ip).replace('.', '-')
+
+def start_discovery():
+    """Bind the non-blocking UDP discovery socket, or return None if the port is unavailable"""
+    import socket
+    try:
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.bind(('0.0.0.0', DISCOVERY_PORT))
+        sock.setblocking(False)
+    except OSError as e:
+        print('UDP discovery disabled:', e)
+        return None
+    print('Answering discovery on UDP port', DISCOVERY_PORT)
+    return sock
+
+_announcement = None
+
+def answer_discovery(sock):
+    """Reply to every discovery probe waiting on the socket"""
+    global _announcement
+    while True:
+        try:
+            data, addr = sock.recvfrom(64)
+        except OSError:
+            return  # Nothing left to read
+        if data.strip() != DISCOVERY_MAGIC:
+            continue
+        if _announcement is None:
+            _announcement = json.dumps({
+                "service": "esp32-led",
+                "name": device_name(),
+                "http_port": HTTP_PORT
+            }).encode()
+        try:
+            sock.sendto(_announcement, addr)
+        except OSError:
+            pass
+
+async def discovery_task(sock):
+    """Answer discovery probes from the uasyncio loop"""
+    while True:
+        answer_discovery(sock)
+        await asyncio.sleep_ms(100)
+
+def binary_command(opcode, args):
+    """Queue the command carried by a binary frame; returns its job ID, or None if the queue is full"""
+    if opcode == CMD_LED_ON or opcode == CMD_LED_OFF:
+        return set_led(opcode == CMD_LED_ON)
+    if opcode == CMD_BLINK:
+        count, interval = struct.unpack('>HH', args)
+        return blink_led(count, interval)
+    if opcode == CMD_PULSE:
+        speed, min_duty, max_duty, times = struct.unpack('>HHHH', args)
+        return pulse_led(speed, min_duty, max_duty, times)
+    if opcode == CMD_TIMELINE:
+        # >H duty, then the same little-endian uint16 timeline that /timeline takes
+        if len(args) < 4 or len(args) % 2:
+            raise ValueError('Timeline must be a non-empty list of uint16 values')
+        return play_timeline(args[2:], struct.unpack('>H', args[:2])[0])
+    if opcode == CMD_MORSE:
+        # >5H dot, dash, element gap, letter gap and word gap, then the UTF-8 message
+        durations = struct.unpack('>HHHHH', args[:10])
+        return flash_morse_code(args[10:].decode('utf-8'), *durations)
+    raise ValueError('Unknown opcode {}'.format(opcode))
+
+def binary_reply(data):
+    """Reply frame for one received frame (None if it is too malformed to answer)"""
+    if len(data) < 5 or struct.unpack('>H', data[:2])[0] != len(data) - 2:
+        return None
+    opcode, seq = struct.unpack('>BH', data[2:5])
+    try:
+        job_id = binary_command(opcode, data[5:])
+    except Exception as e:
+        # struct errors for short arguments are ValueError on MicroPython, struct.error on CPython
+        status, payload = BIN_BAD_REQUEST, str(e).encode('utf-8')
+    else:
+        if job_id is None:
+            status, payload = BIN_QUEUE_FULL, struct.pack('>HH', full_lane[0], full_lane[1])
+        else:
+            status, payload = BIN_OK, struct.pack('>I', job_id)
+    return struct.pack('>HBHB', len(payload) + 4, opcode | BIN_ACK, seq, status) + payload
+
+def start_binary():
+    """Bind the non-blocking binary command socket, or return None if the port is unavailable"""
+    import socket
+    try:
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.bind(('0.0.0.0', BINARY_PORT))
+        sock.setblocking(False)
+    except OSError as e:
+        print('Binary commands disabled:', e)
+        return None
+    print('Binary commands on UDP port', BINARY_PORT)
+    return sock
+
+_binary_replies = []  # (address, sequence number, reply) of recent frames
+
+def answer_binary(sock):
+    """Execute and acknowledge every frame waiting on the binary socket"""
+    while True:
+        try:
+            data, addr = sock.recvfrom(BINARY_MAX_FRAME)
+        except OSError:
+            return  # Nothing left to read
+        reply = None
+        if len(data) >= 5:
+            seq = data[3] << 8 | data[4]
+            for entry in _binary_replies:
+                if entry[0] == addr and entry[1] == seq:
+                    reply = entry[2]  # Retransmission: the command is already queued
+                    break
+        if reply is None:
+            reply = binary_reply(data)
+            if reply is None:
+                continue
+            _binary_replies.append((addr, seq, reply))
+            if len(_binary_replies) > BINARY_DEDUPE:
+                _binary_replies.pop(0)
+        try:
+            sock.sendto(reply, addr)
+        except OSError:
+            pass
+
+async def binary_task(sock):
+    """Serve binary commands from the uasyncio loop"""
+    while True:
+        answer_binary(sock)
+        await asyncio.sleep_ms(BINARY_POLL_MS)
+
+def status_stats():
+    """Queue, LED, latency, network and thread state"""
+    with queue_lock:
+        waiting = queue_length()
+        queue_is_running = queue_running
+        current_job = running_job
+    
+    connected = wlan is not None and wlan.isconnected()
+    return {
+        "name": device_name(),
+        "uptime_seconds": time.time(),
+        "uptime_ms": time.ticks_ms(),
+        "queue_length": waiting,
+        "running_job": current_job,
+        "queue_running": queue_is_running,
+        "progress": job_progress(current_job) if current_job is not None else None,
+        "led_state": led_state,
+        "queue_latency_us": {
+            "last": latency_last_us,
+            "max": latency_max_us,
+            "avg": latency_total_us // latency_count if latency_count else 0,
+            "samples": latency_count
+        },
+        "wifi_connected": connected,
+        "ip_address": wlan.ifconfig()[0] if connected else None,
+        "threads": {
+            "active": len(active_threads),
+            "total_created": thread_counter
+        },
+        "fast_boot": FAST_BOOT,
+        "boot_ms": boot_ms
+    }
+
+def json_route(build):
+    """Wrap a stats builder as a JSON response, reporting failures as 500"""
+    try:
+        return ('200 OK', 'application/json', json.dumps(build()))
+    except Exception as e:
+        return ('500 Internal Server Error', 'text/plain', 'Error: ' + str(e))
+
+def route_storage(req):
+    return json_route(storage_stats)
+
+def route_memory(req):
+    # Collect by default for accurate numbers; ?gc=0 skips the pause
+    collect = req.int_param('gc', 1) != 0
+    return json_route(lambda: memory_stats(collect))
+
+def route_status(req):
+    return json_route(status_stats)
+
+def route_telemetry(req):
+    # Status, memory and storage in one response; ?gc=1 forces a collection
+    collect = req.int_param('gc', 0) != 0
+    return json_route(lambda: {
+        "status": status_stats(),
+        "memory": memory_stats(collect),
+        "storage": storage_stats()
+    })
+
+def route_cancel(req):
+    # Stop the running command early (or just ?job=<id>); ?clear=1 also drops everything queued
+    job = req.query.get('job')
+    cancelled, dropped = cancel_command(int(job) if job else None, req.int_param('clear', 0) != 0)
+    return ('200 OK', 'application/json', json.dumps({"cancelled": cancelled, "dropped": dropped}))
+
+def route_queue_clear(req):
+    # Drop every queued command; the running one finishes normally
+    return ('200 OK', 'application/json', json.dumps({"cancelled": None, "dropped": clear_queue()}))
+
+def route_restart(req):
+    global restart_requested
+    restart_requested = True
+    return ('200 OK', 'text/plain', 'Restarting...')
+
+# Route table: path -> (method, handler). Handlers return (status, content_type, body)
+ROUTES = {
+    '/led/on': ('GET', route_led_on),
+    '/led/off': ('GET', route_led_off),
+    '/led/blink': ('GET', route_led_blink),
+    '/led/pulse': ('GET', route_led_pulse),
+    '/morse': ('GET', route_morse),
+    '/timeline': ('POST', route_timeline),
+    '/batch': ('POST', route_batch),
+    '/storage': ('GET', route_storage),
+    '/memory': ('GET', route_memory),
+    '/status': ('GET', route_status),
+    '/telemetry': ('GET', route_telemetry),
+    '/restart': ('GET', route_restart),
+    '/cancel': ('GET', route_cancel),
+    '/queue/clear': ('GET', route_queue_clear),
+    '/events': ('GET', route_events),
+    '/jobs/': ('GET', route_job),  # Trailing '/' matches any final path segment
+}
+
+def handle_request(req):
+    """Dispatch a parsed request through the route table"""
+    route = ROUTES.get(req.path) or ROUTES.get(req.path[:req.path.rfind('/') + 1])
+    if route is None:
+        return ('404 Not Found', 'text/plain', 'Endpoint not found')
+    if req.method != route[0]:
+        return ('405 Method Not Allowed', 'text/plain', 'Use ' + route[0])
+    try:
+        return route[1](req)
+    except ValueError as e:
+        return ('400 Bad Request', 'text/plain', str(e))
+
+def after_response():
+    """Actions that must wait until the response has been sent"""
+    if restart_requested:
+        time.sleep_ms(100)
+        machine.reset()
+
+def http_response(status, content_type, body, keep_alive=True, headers=None):
+    """Build an HTTP/1.1 response with framing suitable for keep-alive"""
+    if isinstance(body, str):
+        body = body.encode('utf-8')
+    extra = ''
+    if headers:
+        for name in headers:
+            extra += '{}: {}\r\n'.format(name, headers[name])
+    header = 'HTTP/1.1 {}\r\nContent-Type: {}\r\nContent-Length: {}\r\nConnection: {}\r\n{}\r\n'.format(
+        status, content_type, len(body), 'keep-alive' if keep_alive else 'close', extra)
+    return header.encode('utf-8') + body
+
+def encode_response(response, keep_alive):
+    """Serialize a handler result: (status, content_type, body[, headers])"""
+    return http_response(response[0], response[1], response[2], keep_alive,
+                         response[3] if len(response) > 3 else None)
+
+def _close_client(poller, clients, conn):
+    """Unregister and close a client connection"""
+    clients.pop(conn, None)
+    try:
+        poller.unregister(conn)
+    except Exception:
+        pass
+    try:
+        conn.close()
+    except Exception:
+        pass
+
+def _serve_client(poller, clients, conn):
+    """Read from a readable client and answer every complete request in its buffer"""
+    state = clients[conn]
+    data = conn.recv(1024)
+    if not data:
+        _close_client(poller, clients, conn)
+        return
+    state[0] += data
+    state[1] = time.ticks_ms()
+    if state[4] is None:
+        _answer_requests(poller, clients, conn)
+    elif len(state[0]) > MAX_REQUEST_SIZE + MAX_BODY_SIZE:
+        # Pipelined data behind a held long-poll can never exceed one full request
+        conn.sendall(http_response('431 Request Header Fields Too Large', 'text/plain',
+                                   'Request too large', False))
+        _close_client(poller, clients, conn)
+
+def _answer_pending(poller, clients, conn):
+    """Re-check a held long-poll request; once answered, continue with buffered requests"""
+    state = clients[conn]
+    state[1] = time.ticks_ms()  # A held request is not idle
+    waiter, keep_alive = state[4]
+    response = waiter()
+    if response is None:
+        return
+    state[4] = None
+    conn.sendall(encode_response(response, keep_alive))
+    if not keep_alive:
+        _close_client(poller, clients, conn)
+        return
+    _answer_requests(poller, clients, conn)
+
+event_streams = {}  # conn -> EventStream, for /events connections of the polling server
+
+def _start_stream(poller, clients, conn, stream):
+    """Hand a connection over from request handling to event streaming"""
+    global event_clients
+    clients.pop(conn, None)
+    event_streams[conn] = stream
+    event_clients = len(event_streams)
+    conn.sendall(EVENT_STREAM_HEADER)
+
+def _close_stream(poller, conn):
+    global event_clients
+    event_streams.pop(conn, None)
+    event_clients = len(event_streams)
+    _close_client(poller, {}, conn)
+
+def _flush_streams(poller):
+    """Send due events to every subscriber, dropping those that have gone away"""
+    for conn in list(event_streams):
+        try:
+            data = event_streams[conn].pending()
+            if data:
+                conn.sendall(data)
+        except Exception:
+            _close_stream(poller, conn)
+
+def _answer_requests(poller, clients, conn):
+    """Answer complete requests in a client's buffer until it needs more data or a request is held"""
+    state = clients[conn]
+    while True:
+        req = state[3]
+        if req is None:
+            header_end = state[0].find(b'\r\n\r\n')
+            if header_end == -1:
+                if len(state[0]) > MAX_REQUEST_SIZE:
+                    conn.sendall(http_response('431 Request Header Fields Too Large', 'text/plain',
+                                               'Request too large', False))
+                    _close_client(poller, clients, conn)
+                return
+            
+            try:
+                req = parse_request(state[0][:header_end].decode('utf-8'))
+            except (ValueError, UnicodeError):
+                conn.sendall(http_response('400 Bad Request', 'text/plain', 'Malformed request', False))
+                _close_client(poller, clients, conn)
+                return
+            if req.content_length() > MAX_BODY_SIZE:
+                conn.sendall(http_response('413 Payload Too Large', 'text/plain', 'Body too large', False))
+                _close_client(poller, clients, conn)
+                return
+            state[0] = state[0][header_end + 4:]
+            state[3] = req
+        
+        length = req.content_length()
+        if len(state[0]) < length:
+            return  # Wait for the rest of the body
+        req.body = state[0][:length]
+        state[0] = state[0][length:]
+        state[3] = None
+        state[2] += 1
+        keep_alive = req.keep_alive() and state[2] < KEEPALIVE_MAX_REQUESTS
+        
+        response = handle_request(req)
+        if isinstance(response, EventStream):
+            _start_stream(poller, clients, conn, response)
+            return
+        if callable(response):
+            # Long-poll: the server loop answers it once the waiter returns a response
+            state[4] = (response, keep_alive)
+            return
+        conn.sendall(encode_response(response, keep_alive))
+        after_response()
+        if not keep_alive:
+            _close_client(poller, clients, conn)
+            return
+
+async def serve_client_async(reader, writer):
+    """Serve keep-alive HTTP requests from one client on the uasyncio loop"""
+    global async_clients
+    async_clients += 1
+    try:
+        if async_clients > MAX_CLIENTS:
+            writer.write(http_response('503 Service Unavailable', 'text/plain', 'Too many connections', False))
+            await writer.drain()
+            return
+        
+        served = 0
+        while True:
+            # Read the request line and headers, bounded by MAX_REQUEST_SIZE
+            head = b''
+            while True:
+                line = await asyncio.wait_for(reader.readline(), KEEPALIVE_IDLE_MS / 1000)
+                if not line:
+                    return  # Client closed the connection
+                if line == b'\r\n':
+                    break
+                head += line
+                if len(head) > MAX_REQUEST_SIZE:
+                    writer.write(http_response('431 Request Header Fields Too Large', 'text/plain',
+                                               'Request too large', False))
+                    await writer.drain()
+                    return
+            
+            try:
+                req = parse_request(head.decode('utf-8').rstrip('\r\n'))
+            except (ValueError, UnicodeError):
+                writer.write(http_response('400 Bad Request', 'text/plain', 'Malformed request', False))
+                await writer.drain()
+                return
+            length = req.content_length()
+            if length > MAX_BODY_SIZE:
+                writer.write(http_response('413 Payload Too Large', 'text/plain', 'Body too large', False))
+                await writer.drain()
+                return
+            if length:
+                req.body = await reader.readexactly(length)
+            
+            served += 1
+            keep_alive = req.keep_alive() and served < KEEPALIVE_MAX_REQUESTS
+            response = handle_request(req)
+            if isinstance(response, EventStream):
+                await stream_events_async(writer, response)
+                return
+            if callable(response):
+                # Long-poll: re-check until the waiter returns a response
+                waiter, response = response, None
+                while response is None:
+                    await asyncio.sleep_ms(JOB_POLL_MS)
+                    response = waiter()
+            writer.write(encode_response(response, keep_alive))
+            await writer.drain()
+            after_response()
+            if not keep_alive:
+                return
+    except Exception as e:
+        # Idle timeouts and dropped clients end up here
+        if not isinstance(e, (asyncio.TimeoutError, OSError)):
+            print('Error handling request:', e)
+    finally:
+        async_clients -= 1
+        writer.close()
+        await writer.wait_closed()
+
+async def stream_events_async(writer, stream):
+    """Send events to one subscriber until it disconnects"""
+    global event_clients
+    event_clients += 1
+    try:
+        writer.write(EVENT_STREAM_HEADER)
+        while True:
+            data = stream.pending()
+            if data:
+                writer.write(data)
+                await writer.drain()
+            await asyncio.sleep_ms(JOB_POLL_MS)
+    finally:
+        event_clients -= 1
+
+async def start_async_server():
+    """Serve HTTP and run the command queue on a single uasyncio loop"""
+    global queue_event
+    queue_event = asyncio.Event()
+    if queue_length() > 0:
+        queue_event.set()  # Commands queued before the loop started
+    
+    asyncio.create_task(process_queue_async())
+    discovery = start_discovery()
+    if discovery is not None:
+        asyncio.create_task(discovery_task(discovery))
+    binary = start_binary()
+    if binary is not None:
+        asyncio.create_task(binary_task(binary))
+    server = await asyncio.start_server(serve_client_async, '0.0.0.0', HTTP_PORT, backlog=5)
+    boot_phase('server_ready')
+    print('Web server started on http://' + ip + ' (asyncio)')
+    
+    while True:
+        await asyncio.sleep(3600)
+
 def start_web_server():
     import socket
+    import select
     
     s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
     s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-    s.bind(('0.0.0.0', 80))
+    s.bind(('0.0.0.0', HTTP_PORT))
     s.listen(5)
+    boot_phase('server_ready')
     
     print('Web server started on http://' + ip)
     
+    # Poll the listening socket together with open keep-alive connections so
+    # an idle persistent client never blocks new ones from being accepted.
+    poller = select.poll()
+    poller.register(s, select.POLLIN)
+    discovery = start_discovery()
+    if discovery is not None:
+        poller.register(discovery, select.POLLIN)
+    binary = start_binary()
+    if binary is not None:
+        poller.register(binary, select.POLLIN)
+    clients = {}  # conn -> [buffer, last_activity_ms, requests_served, pending_request, held_request]
+    
     while True:
         try:
-            conn, addr = s.accept()
-            request = conn.recv(1024).decode('utf-8')
+            held = [c for c in clients if clients[c][4] is not None]
+            for entry in poller.poll(JOB_POLL_MS if held or event_streams else 1000):
+                sock, event = entry[0], entry[1]
+                if sock is s:
+                    conn, addr = s.accept()
+                    conn.settimeout(2)
+                    if len(clients) >= MAX_CLIENTS:
+                        # Make room by dropping the least recently used connection
+                        oldest = min(clients, key=lambda c: clients[c][1])
+                        _close_client(poller, clients, oldest)
+                    clients[conn] = [b'', time.ticks_ms(), 0, None, None]
+                    poller.register(conn, select.POLLIN)
+                elif sock is binary:
+                    answer_binary(binary)
+                elif sock is discovery:
+                    answer_discovery(discovery)
+                elif sock in event_streams:
+                    # Subscribers only send to hang up; anything readable ends the stream
+                    _close_stream(poller, sock)
+                elif event & (select.POLLHUP | select.POLLERR):
+                    _close_client(poller, clients, sock)
+                elif sock in clients:
+                    try:
+                        _serve_client(poller, clients, sock)
+                    except Exception as e:
+                        print('Error handling request:', e)
+                        _close_client(poller, clients, sock)
             
-            # Handle LED control
-            if 'GET /led/on' in request:
-                set_led(True)
-                response = 'HTTP/1.1 200 OK\nContent-Type: text/plain\n\nLED ON'
-            elif 'GET /led/off' in request:
-                set_led(False)
-                response = 'HTTP/1.1 200 OK\nContent-Type: text/plain\n\nLED OFF'
-            elif 'GET /morse' in request:
-                # Extract message from request
-                msg_start = request.find('message=') + 8
-                if msg_start > 7:
-                    msg_end = request.find(' ', msg_start)
-                    if msg_end == -1:  # If no space after message
-                        msg_end = len(request)
-                    message = request[msg_start:msg_end].split('&')[0]
-                    message = message.replace('+', ' ')
-                    
-                    # Extract optional parameters
-                    params = {}
-                    param_names = ['dot', 'dash', 'element_gap', 'letter_gap', 'word_gap']
-                    for param in param_names:
-                        param_start = request.find(param + '=')
-                        if param_start > -1:
-                            param_start += len(param) + 1
-                            param_end = request.find('&', param_start)
-                            if param_end == -1:
-                                param_end = request.find(' ', param_start)
-                            if param_end == -1:
-                                param_end = len(request)
-                            try:
-                                params[param] = int(request[param_start:param_end])
-                            except ValueError:
-                                pass
-                    
-                    # Queue the Morse code command (non-blocking)
-                    flash_morse_code(
-                        message,
-                        dot_duration=params.get('dot', 100),
-                        dash_duration=params.get('dash', 300),
-                        element_gap=params.get('element_gap', 100),
-                        letter_gap=params.get('letter_gap', 300),
-                        word_gap=params.get('word_gap', 700)
-                    )
-                    response = 'HTTP/1.1 200 OK\nContent-Type: text/plain\n\nMorse code queued'
-                else:
-                    response = 'HTTP/1.1 400 Bad Request\nContent-Type: text/plain\n\nMissing message parameter'
-            elif 'GET /storage' in request:
-                # Get storage information
-                import os
-                try:
-                    # Get filesystem stats
-                    fs_stat = os.statvfs('/')
-                    block_size = fs_stat[0]
-                    total_blocks = fs_stat[2]
-                    free_blocks = fs_stat[3]
-                    
-                    total_space = block_size * total_blocks
-                    free_space = block_size * free_blocks
-                    used_space = total_space - free_space
-                    
-                    # Create JSON response
-                    storage_json = {
-                        "total_bytes": total_space,
-                        "used_bytes": used_space,
-                        "free_bytes": free_space,
-                        "used_percent": round((used_space / total_space) * 100, 1) if total_space > 0 else 0
-                    }
-                    
-                    import json
-                    json_response = json.dumps(storage_json)
-                    response = 'HTTP/1.1 200 OK\nContent-Type: application/json\n\n' + json_response
-                except Exception as e:
-                    response = 'HTTP/1.1 500 Internal Server Error\nContent-Type: text/plain\n\nError: ' + str(e)
-            elif 'GET /memory' in request:
-                # Get memory information
-                import gc
-                try:
-                    # Force garbage collection to get accurate numbers
-                    gc.collect()
-                    
-                    # Get memory stats
-                    free = gc.mem_free()
-                    allocated = gc.mem_alloc()
-                    total = free + allocated
-                    
-                    # Calculate fragmentation
-                    # Higher fragmentation means memory is more scattered
-                    fragmentation = 0
-                    if total > 0:
-                        fragmentation = round((1 - (free / total)) * 100, 1)
-                    
-                    # Create JSON response
-                    memory_json = {
-                        "free": free,
-                        "allocated": allocated,
-                        "total": total,
-                        "free_percent": round((free / total) * 100, 1) if total > 0 else 0,
-                        "fragmentation": fragmentation
-                    }
-                    
-                    import json
-                    json_response = json.dumps(memory_json)
-                    response = 'HTTP/1.1 200 OK\nContent-Type: application/json\n\n' + json_response
-                except Exception as e:
-                    response = 'HTTP/1.1 500 Internal Server Error\nContent-Type: text/plain\n\nError: ' + str(e)
-            elif 'GET /status' in request:
-                # Get system status information
-                try:
-                    import json
-                    import time
-                    
-                    # Get queue information
-                    with queue_lock:
-                        queue_length = len(cmd_queue)
-                        queue_is_running = queue_running
-                    
-                    # Get thread information
-                    thread_count = len(active_threads)
-                    
-                    # Create JSON response with system status
-                    status_json = {
-                        "uptime_seconds": time.time(),
-                        "queue_length": queue_length,
-                        "queue_running": queue_is_running,
-                        "led_state": led_state,
-                        "wifi_connected": network.WLAN(network.STA_IF).isconnected(),
-                        "ip_address": network.WLAN(network.STA_IF).ifconfig()[0],
-                        "threads": {
-                            "active": thread_count,
-                            "total_created": thread_counter
-                        }
-                    }
-                    
-                    json_response = json.dumps(status_json)
-                    response = 'HTTP/1.1 200 OK\nContent-Type: application/json\n\n' + json_response
-                except Exception as e:
-                    response = 'HTTP/1.1 500 Internal Server Error\nContent-Type: text/plain\n\nError: ' + str(e)
-            else:
-                response = 'HTTP/1.1 404 Not Found\nContent-Type: text/plain\n\nEndpoint not found'
-                
-            conn.send(response.encode('utf-8'))
-            conn.close()
+            # Answer held long-poll requests whose jobs have finished or timed out
+            for conn in held:
+                if conn in clients:
+                    try:
+                        _answer_pending(poller, clients, conn)
+                    except Exception as e:
+                        print('Error handling request:', e)
+                        _close_client(poller, clients, conn)
+            
+            _flush_streams(poller)
+            
+            # Close connections that have been idle for too long
+            now = time.ticks_ms()
+            for conn in [c for c in clients if time.ticks_diff(now, clients[c][1]) > KEEPALIVE_IDLE_MS]:
+                _close_client(poller, clients, conn)
         except Exception as e:
             print('Error handling request:', e)
 
 # Main execution
 print("Starting ESP32...")
+boot_phase('code_run')
 ip = connect_wifi()
 
-# Start the command queue processor thread
-print("# Start the command processor in a new thread")
-create_thread(process_queue_thread)
-
-# Wait for the queue processor to start
-time.sleep(0.5)
-
-# Simple test sequence
-print("Testing LED...")
-set_led(True)
-time.sleep(1)
-set_led(False)
-time.sleep(0.5)
-
-print("Testing pulse...")
-pulse_led(times=2)
-time.sleep(1)
+if not USE_ASYNCIO:
+    # Start the command queue processor thread
+    print("# Start the command processor in a new thread")
+    create_thread(process_queue_thread)
+    
+    if not FAST_BOOT:
+        # Wait for the queue processor to start
+        time.sleep(0.5)
 
-print("Testing Morse code...")
-flash_morse_code("SOS")
+if SELF_TEST and FAST_BOOT:
+    # Queued behind nothing, so it plays while the server is already answering
+    print("Queueing self-test...")
+    blink_led(count=1, interval_ms=1500)
+    pulse_led(times=2)
+    flash_morse_code("SOS")
+elif SELF_TEST:
+    # Simple test sequence (in asyncio mode it plays once the loop starts)
+    print("Testing LED...")
+    set_led(True)
+    time.sleep(1)
+    set_led(False)
+    time.sleep(0.5)
+    
+    print("Testing pulse...")
+    pulse_led(times=2)
+    time.sleep(1)
+    
+    print("Testing Morse code...")
+    flash_morse_code("SOS")
+    boot_phase('self_test_done')
 
 # Start the web server
 print("Starting web server...")
-start_web_server()
\ No newline at end of file
+if USE_ASYNCIO:
+    asyncio.run(start_async_server())
+else:
+    start_web_server()
@@ -1,10 +1,33 @@
-from fastmcp import FastMCP
+from fastmcp import Context, FastMCP
+import array
+import asyncio
+import bisect
+import collections
+import functools
+import http.server
+import ipaddress
+import re
 import requests
 import logging
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, List, Tuple, Callable, Awaitable
 from pydantic import BaseModel, Field
+import json
 import os
+import random
+import struct
+import sys
+import threading
+import time
 import urllib.parse
+from requests.adapters import HTTPAdapter
+from contextlib import asynccontextmanager
+from starlette.requests import Request
+from starlette.responses import PlainTextResponse
+
+try:
+    import httpx
+except ImportError:
+    httpx = None
 
 # Configure logging
 logging.basicConfig(
@@ -13,49 +36,1403 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+@asynccontextmanager
+async def lifespan(server: FastMCP):
+    """Start background tasks with the server and release connections on shutdown."""
+    if TELEMETRY_INTERVAL > 0:
+        start_telemetry(TELEMETRY_INTERVAL)
+    if EVENTS_ENABLED and not MOCK_MODE:
+        start_events()
+    if METRICS_PORT:
+        start_metrics_server(METRICS_PORT)
+    try:
+        yield
+    finally:
+        stop_telemetry()
+        stop_events()
+        await close_async_clients()
+
 # Create an MCP server
-mcp = FastMCP("ESP32-LED-Controller")
+mcp = FastMCP("ESP32-LED-Controller", lifespan=lifespan)
 
 # Configuration
 ESP32_IP = os.getenv("ESP32_IP", "192.168.2.150")  # Your ESP32's IP
 ESP32_PORT = int(os.getenv("ESP32_PORT", "80"))
 MOCK_MODE = os.getenv("MOCK_MODE", "false").lower() == "true"
-mock_led_state = False
+
+# Command types (CMD_* in main.py): /batch entries and binary frame opcodes
+CMD_LED_ON = 1
+CMD_LED_OFF = 2
+CMD_MORSE = 3
+CMD_BLINK = 4
+CMD_PULSE = 5
+CMD_TIMELINE = 6
+
+# Morse code dictionary (same table as the firmware)
+MORSE_CODE_DICT = {
+    'A': '.-', 'B': '-...', 'C': '-.-.', 'D': '-..', 'E': '.', 'F': '..-.',
+    'G': '--.', 'H': '....', 'I': '..', 'J': '.---', 'K': '-.-', 'L': '.-..',
+    'M': '--', 'N': '-.', 'O': '---', 'P': '.--.', 'Q': '--.-', 'R': '.-.',
+    'S': '...', 'T': '-', 'U': '..-', 'V': '...-', 'W': '.--', 'X': '-..-',
+    'Y': '-.--', 'Z': '--..',
+    '1': '.----', '2': '..---', '3': '...--', '4': '....-', '5': '.....',
+    '6': '-....', '7': '--...', '8': '---..', '9': '----.', '0': '-----',
+    ',': '--..--', '.': '.-.-.-', '?': '..--..', '/': '-..-.', '-': '-....-',
+    '(': '-.--.', ')': '-.--.-', ' ': '/', "'": '.----.', ':': '---...',
+    ';': '-.-.-.', '=': '-...-', '+': '.-.-.', '_': '..--.-', '"': '.-..-.',
+    '$': '...-..-', '@': '.--.-.', '!': '-.-.--', '&': '.-...'
+}
+
+FANOUT_CONCURRENCY = int(os.getenv("ESP32_FANOUT_CONCURRENCY", "8"))
+
+# Connection pooling: each device keeps its own keep-alive session, so back-to-back
+# tool calls reuse the same TCP connection instead of paying a new handshake.
+POOL_MAXSIZE = int(os.getenv("ESP32_POOL_MAXSIZE", "2"))
+
+# Async transport: tools await device calls on a pooled httpx client so a slow
+# or offline ESP32 never blocks other in-flight tool calls. Without httpx (or with
+# ESP32_ASYNC_TRANSPORT=false) the pooled requests session runs in a worker thread.
+ASYNC_TRANSPORT = httpx is not None and os.getenv("ESP32_ASYNC_TRANSPORT", "true").lower() == "true"
+
+# Read cache: per-device, per-endpoint TTLs in seconds (0 disables caching). Entries
+# past their TTL are still served for up to CACHE_MAX_STALE seconds while a single
+# background request refreshes them.
+CACHE_TTLS = {
+    "status": float(os.getenv("ESP32_CACHE_TTL_STATUS", "2")),
+    "memory": float(os.getenv("ESP32_CACHE_TTL_MEMORY", "10")),
+    "storage": float(os.getenv("ESP32_CACHE_TTL_STORAGE", "60")),
+    "telemetry": float(os.getenv("ESP32_CACHE_TTL_TELEMETRY", "2")),
+}
+CACHE_MAX_STALE = float(os.getenv("ESP32_CACHE_MAX_STALE", "30"))
+
+# Read-only endpoints: identical concurrent GETs to one device share a single request
+READ_ONLY_ENDPOINTS = {"status", "memory", "storage", "telemetry"}
+
+# Largest request body the firmware accepts (its MAX_BODY_SIZE); longer Morse timelines
+# are sent as /morse text for the device to time itself
+TIMELINE_MAX_BYTES = 4096
+
+# Longest single /jobs/<id> long-poll requested by wait_for_command (the firmware caps it at 10s)
+JOB_WAIT_MS = 10000
+JOB_FINISHED = ("done", "cancelled", "failed")  # Final job states ("failed": the command raised on the device)
+
+# Background telemetry: sample /telemetry every TELEMETRY_INTERVAL seconds
+# (0 disables) into a ring buffer of TELEMETRY_HISTORY samples per device
+TELEMETRY_INTERVAL = float(os.getenv("ESP32_TELEMETRY_INTERVAL", "0"))
+TELEMETRY_HISTORY = int(os.getenv("ESP32_TELEMETRY_HISTORY", "720"))
+
+# Device events: follow each registered device's /events stream and mirror its LED, queue
+# and heap state in memory, so status reads and esp32://devices/{name}/state resource
+# subscribers see changes as they happen instead of polling /status
+EVENTS_ENABLED = os.getenv("ESP32_EVENTS", "false").lower() == "true"
+EVENTS_RECONNECT = 2.0      # First reconnect delay in seconds, doubled up to EVENTS_RECONNECT_MAX
+EVENTS_RECONNECT_MAX = 30.0
+EVENTS_READ_TIMEOUT = 45.0  # The firmware sends a keep-alive comment every 15s
+
+# Metrics: latency histogram buckets in seconds, and an optional standalone port
+# serving them in Prometheus text format (0 disables; useful with the stdio transport)
+METRICS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+METRICS_PORT = int(os.getenv("ESP32_METRICS_PORT", "0"))
+
+# Circuit breaker: after BREAKER_THRESHOLD consecutive timeouts or connection failures a
+# device fails fast for BREAKER_COOLDOWN seconds, then one caller probes /status
+BREAKER_THRESHOLD = int(os.getenv("ESP32_BREAKER_THRESHOLD", "3"))
+BREAKER_COOLDOWN = float(os.getenv("ESP32_BREAKER_COOLDOWN", "10"))
+BREAKER_PROBE_TIMEOUT = 1.0
+
+# Retries: requests that never reached the device (and timed-out reads) are retried with
+# full-jitter exponential backoff from RETRY_BACKOFF, within RETRY_BUDGET seconds per call
+RETRY_BACKOFF = float(os.getenv("ESP32_RETRY_BACKOFF", "0.1"))
+RETRY_BUDGET = float(os.getenv("ESP32_RETRY_BUDGET", "1.0"))
+
+# Restart readiness: restart_and_wait polls /status (outside the circuit breaker) every
+# RESTART_POLL_MIN seconds, backing off by half again per unanswered probe up to
+# RESTART_POLL_MAX, and gives each probe RESTART_PROBE_TIMEOUT so a lost packet cannot stall it
+RESTART_POLL_MIN = 0.05
+RESTART_POLL_MAX = 1.0
+RESTART_PROBE_TIMEOUT = 0.5
+
+# Discovery: discover_devices broadcasts DISCOVERY_MAGIC to DISCOVERY_PORT (answered by
+# the firmware) and/or probes /status on every address in a CIDR range, at most
+# DISCOVERY_CONCURRENCY connections at a time. Results are cached for DISCOVERY_CACHE_TTL seconds.
+DISCOVERY_PORT = int(os.getenv("ESP32_DISCOVERY_PORT", "4210"))
+DISCOVERY_ADDRESS = os.getenv("ESP32_DISCOVERY_ADDRESS", "255.255.255.255")
+DISCOVERY_CONCURRENCY = int(os.getenv("ESP32_DISCOVERY_CONCURRENCY", "64"))
+DISCOVERY_CACHE_TTL = float(os.getenv("ESP32_DISCOVERY_CACHE_TTL", "300"))
+DISCOVERY_MAGIC = b"ESP32-LED-DISCOVER"
+DISCOVERY_MAX_TARGETS = 65536
+DISCOVERY_MAX_RESPONSE = 65536  # Bytes read from a probed /status before giving up on it
+STATUS_SIGNATURE = {"queue_running", "led_state", "threads"}  # Keys only this firmware's /status returns
+
+# Binary transport: devices using transport "binary" (ESP32_TRANSPORT, or "transport" per device
+# in ESP32_DEVICES / register_device) receive LED commands as UDP frames on BINARY_PORT
+# instead of HTTP requests. Unacknowledged frames are resent every BINARY_TIMEOUT seconds,
+# BINARY_ATTEMPTS times in all. Reads, batches and commands without a binary form use HTTP.
+# Until a device has acknowledged a frame, an unanswered one is treated as possibly lost:
+# commands go over HTTP for BINARY_REPROBE_DELAY seconds, then binary is tried again. The
+# device is switched to HTTP for good once the port is refused (ICMP port unreachable) or
+# BINARY_PROBE_FAILURES probes in a row go unanswered.
+TRANSPORTS = ("http", "binary")
+TRANSPORT = os.getenv("ESP32_TRANSPORT", "http").lower()
+BINARY_PORT = int(os.getenv("ESP32_BINARY_PORT", "4211"))
+BINARY_TIMEOUT = float(os.getenv("ESP32_BINARY_TIMEOUT", "0.25"))
+BINARY_ATTEMPTS = 3
+BINARY_REPROBE_DELAY = 30.0
+BINARY_PROBE_FAILURES = 3
+BINARY_MAX_FRAME = 1400  # The firmware's limit (one Wi-Fi packet)
+BIN_ACK = 0x80
+BIN_OK = 0
+BIN_QUEUE_FULL = 1
+BIN_BAD_REQUEST = 2
+
+class DeviceUnavailable(Exception):
+    """Raised without contacting a device whose circuit breaker is open."""
+
+class CircuitBreaker:
+    """Per-device breaker: closed -> open after repeated failures -> half-open probe -> closed."""
+    
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+    
+    def __init__(self, name: str):
+        self.name = name
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._lock = threading.Lock()
+    
+    def before_request(self) -> bool:
+        """Admit a request. Returns True if the caller must probe the device first.
+        
+        Raises DeviceUnavailable while the breaker is open (or another caller is probing).
+        """
+        with self._lock:
+            if self.state == self.CLOSED:
+                return False
+            remaining = BREAKER_COOLDOWN - (time.monotonic() - self.opened_at)
+            if self.state == self.OPEN and remaining <= 0:
+                self.state = self.HALF_OPEN
+                return True
+            half_open = self.state == self.HALF_OPEN
+        if half_open:
+            raise DeviceUnavailable(f"Device '{self.name}' is unreachable (another request is probing it)")
+        raise DeviceUnavailable(
+            f"Device '{self.name}' is unreachable (circuit open after {self.failures} failures, "
+            f"next probe in {max(0.0, remaining):.1f}s)"
+        )
+    
+    def record_success(self) -> None:
+        with self._lock:
+            if self.state != self.CLOSED:
+                logger.info(f"Device '{self.name}' is reachable again; closing circuit")
+            self.state = self.CLOSED
+            self.failures = 0
+    
+    def record_failure(self) -> None:
+        with self._lock:
+            self.failures += 1
+            if self.state == self.HALF_OPEN or self.failures >= BREAKER_THRESHOLD:
+                if self.state == self.CLOSED:
+                    logger.warning(f"Device '{self.name}' failed {self.failures} times; opening circuit")
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+    
+    def probe_aborted(self) -> None:
+        """The half-open probe ended without an outcome (e.g. it was cancelled): open for a new cooldown."""
+        with self._lock:
+            if self.state == self.HALF_OPEN:
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+    
+    def reset(self) -> None:
+        """Close the breaker (e.g. after the device's address changes)."""
+        with self._lock:
+            self.state = self.CLOSED
+            self.failures = 0
+
+class Device:
+    """A registered ESP32 board and its connection state."""
+    
+    def __init__(
+        self, name: str, ip: str, port: int = 80, groups: Optional[List[str]] = None, transport: Optional[str] = None
+    ):
+        self.name = name
+        self.ip = ip
+        self.port = port
+        self.groups = set(groups or [])
+        self.transport = transport or TRANSPORT
+        self.binary_port = BINARY_PORT
+        self.binary: Optional[str] = None  # None until the first frame: "ok" or "unsupported"
+        self.binary_failures = 0  # Unanswered probes in a row while binary is None
+        self.binary_retry_at = 0.0  # time.monotonic() before which commands skip the binary probe
+        self._binary_channel: Optional["BinaryChannel"] = None
+        self.mock_led_state = False
+        self.cache: Dict[str, Tuple[float, Dict[str, Any]]] = {}  # endpoint -> (fetched_at, result)
+        self.refreshing: Dict[str, asyncio.Task] = {}
+        self.cache_epoch = 0  # Bumped on invalidation so in-flight reads are not cached
+        self.telemetry: collections.deque = collections.deque(maxlen=TELEMETRY_HISTORY)  # (time, metrics)
+        self.telemetry_errors = 0
+        self.inflight: Dict[str, asyncio.Task] = {}  # Read-only GETs in progress, by endpoint
+        self.inflight_sync: Dict[str, "_SyncFlight"] = {}
+        self._session: Optional[requests.Session] = None
+        self._async_client = None
+        self.breaker = CircuitBreaker(name)
+        self.mirror: Dict[str, Any] = {}  # Device state as last reported on /events
+        self.mirror_at: Optional[float] = None
+        self.events = "off"  # off, connecting, live or unsupported
+        self.events_task: Optional[asyncio.Task] = None
+        self._lock = threading.Lock()
+    
+    def url(self, endpoint: str) -> str:
+        """Build the URL for an endpoint on this device."""
+        return f"http://{self.ip}:{self.port}/{endpoint}"
+    
+    def session(self) -> requests.Session:
+        """Return this device's pooled HTTP session."""
+        with self._lock:
+            if self._session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=POOL_MAXSIZE)
+                session.mount("http://", adapter)
+                session.headers["Connection"] = "keep-alive"
+                self._session = session
+            return self._session
+    
+    def async_client(self) -> "httpx.AsyncClient":
+        """Return this device's pooled async HTTP client."""
+        client = self._async_client
+        if client is None or client.is_closed:
+            limits = httpx.Limits(max_connections=POOL_MAXSIZE, max_keepalive_connections=POOL_MAXSIZE)
+            client = httpx.AsyncClient(limits=limits, headers={"Connection": "keep-alive"})
+            self._async_client = client
+        return client
+    
+    async def binary_channel(self) -> "BinaryChannel":
+        """Return this device's UDP command channel, opening it if needed."""
+        channel = self._binary_channel
+        if channel is None or channel.closed:
+            _, channel = await asyncio.get_running_loop().create_datagram_endpoint(
+                BinaryChannel, remote_addr=(self.ip, self.binary_port))
+            if self._binary_channel is not None and not self._binary_channel.closed:
+                channel.close()  # Another caller opened one first
+                return self._binary_channel
+            self._binary_channel = channel
+        return channel
+    
+    def close(self) -> None:
+        """Drop pooled connections (e.g. after the address changes)."""
+        with self._lock:
+            if self._session is not None:
+                self._session.close()
+                self._session = None
+        channel, self._binary_channel = self._binary_channel, None
+        if channel is not None:
+            channel.close()
+        self.binary = None
+        self.binary_failures = 0
+        self.binary_retry_at = 0.0
+        task, self.events_task = self.events_task, None
+        if task is not None:
+            task.get_loop().call_soon_threadsafe(task.cancel)  # Reconnects to the new address
+        self.events = "off"
+        client, self._async_client = self._async_client, None
+        if client is not None and not client.is_closed:
+            try:
+                asyncio.get_running_loop().create_task(client.aclose())
+            except RuntimeError:
+                pass
+    
+    def invalidate(self, endpoint: Optional[str] = None) -> None:
+        """Drop a cached read (or every cached read) for this device."""
+        self.cache_epoch += 1
+        if endpoint is None:
+            self.cache.clear()
+        else:
+            self.cache.pop(endpoint, None)
+    
+    def events_live(self) -> bool:
+        return self.events == "live" and bool(self.mirror)
+    
+    def describe(self) -> Dict[str, Any]:
+        """Summary of the device for tool responses."""
+        return {"name": self.name, "ip": self.ip, "port": self.port, "groups": sorted(self.groups),
+                "transport": self.transport, "circuit": self.breaker.state, "events": self.events}
+
+class BinaryChannel(asyncio.DatagramProtocol):
+    """A device's UDP command channel; acknowledgements are matched to frames by sequence number."""
+    
+    def __init__(self):
+        self.transport: Optional[asyncio.DatagramTransport] = None
+        self.pending: Dict[int, asyncio.Future] = {}
+        # Random start, so a restarted server is not answered from the firmware's replay cache
+        self.seq = random.randrange(0x10000)
+        self.closed = False
+    
+    def connection_made(self, transport: asyncio.DatagramTransport) -> None:
+        self.transport = transport
+    
+    def datagram_received(self, data: bytes, addr: Tuple[str, int]) -> None:
+        if len(data) < 6:
+            return
+        _, opcode, seq, status = struct.unpack(">HBHB", data[:6])
+        future = self.pending.get(seq)
+        if future is not None and not future.done() and opcode & BIN_ACK:
+            future.set_result((status, data[6:]))
+    
+    def error_received(self, exc: Exception) -> None:
+        # ICMP port unreachable: nothing is listening on the binary port
+        self._fail(exc)
+    
+    def connection_lost(self, exc: Optional[Exception]) -> None:
+        self.closed = True
+        self._fail(exc or ConnectionError("Binary channel closed"))
+    
+    def _fail(self, exc: Exception) -> None:
+        for future in self.pending.values():
+            if not future.done():
+                future.set_exception(exc)
+    
+    def close(self) -> None:
+        self.closed = True
+        if self.transport is not None:
+            self.transport.close()
+    
+    async def request(self, opcode: int, args: bytes) -> Tuple[int, bytes]:
+        """Send a frame until it is acknowledged; returns the reply's status and payload."""
+        self.seq = (self.seq + 1) & 0xFFFF
+        seq = self.seq
+        frame = struct.pack(">HBH", len(args) + 3, opcode, seq) + args
+        future = asyncio.get_running_loop().create_future()
+        self.pending[seq] = future
+        try:
+            for _ in range(BINARY_ATTEMPTS):
+                self.transport.sendto(frame)
+                try:
+                    return await asyncio.wait_for(asyncio.shield(future), BINARY_TIMEOUT)
+                except asyncio.TimeoutError:
+                    continue  # Resend; the firmware acknowledges duplicates without requeuing
+            raise asyncio.TimeoutError(f"No acknowledgement after {BINARY_ATTEMPTS} attempts")
+        finally:
+            del self.pending[seq]
+
+class _SyncFlight:
+    """A synchronous read in progress that other threads can wait on."""
+    
+    def __init__(self):
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: Optional[Exception] = None
+
+class DeviceRegistry:
+    """Named ESP32 devices, addressable individually or by group."""
+    
+    DEFAULT = "default"
+    
+    def __init__(self):
+        self._devices: Dict[str, Device] = {}
+        self._lock = threading.Lock()
+    
+    def add(
+        self, name: str, ip: str, port: int = 80, groups: Optional[List[str]] = None, transport: Optional[str] = None
+    ) -> Device:
+        """Register a device, or update the address, groups and transport of an existing one."""
+        if transport is not None and transport not in TRANSPORTS:
+            raise ValueError(f"Unknown transport '{transport}' (use {' or '.join(TRANSPORTS)})")
+        with self._lock:
+            device = self._devices.get(name)
+            if device is None:
+                device = Device(name, ip, port, groups, transport)
+                self._devices[name] = device
+                return device
+        if (device.ip, device.port) != (ip, port):
+            device.close()
+            device.invalidate()
+            device.breaker.reset()
+            device.ip, device.port = ip, port
+        if groups is not None:
+            device.groups = set(groups)
+        if transport is not None:
+            device.transport = transport
+        return device
+    
+    def remove(self, name: str) -> Device:
+        with self._lock:
+            device = self._devices.pop(name)
+        device.close()
+        return device
+    
+    def get(self, name: Optional[str] = None) -> Device:
+        """Look up a device by name (the default device when name is None)."""
+        name = name or self.DEFAULT
+        with self._lock:
+            if name not in self._devices:
+                raise KeyError(f"Unknown device '{name}'")
+            return self._devices[name]
+    
+    def select(self, group: str) -> List[Device]:
+        """Devices in a group; the group "all" matches every device."""
+        with self._lock:
+            devices = list(self._devices.values())
+        if group == "all":
+            return devices
+        return [d for d in devices if group in d.groups]
+    
+    def all(self) -> List[Device]:
+        with self._lock:
+            return list(self._devices.values())
+
+def load_registry() -> DeviceRegistry:
+    """Build the registry from ESP32_IP/ESP32_PORT plus the optional ESP32_DEVICES JSON.
+
+    ESP32_DEVICES maps names to {"ip": ..., "port": ..., "groups": [...], "transport": ...,
+    "binary_port": ...}.
+    """
+    reg = DeviceRegistry()
+    reg.add(DeviceRegistry.DEFAULT, ESP32_IP, ESP32_PORT)
+    for name, cfg in json.loads(os.getenv("ESP32_DEVICES", "{}")).items():
+        device = reg.add(name, cfg["ip"], int(cfg.get("port", 80)), cfg.get("groups"), cfg.get("transport"))
+        device.binary_port = int(cfg.get("binary_port", BINARY_PORT))
+    return reg
+
+registry = load_registry()
+
+async def close_async_clients() -> None:
+    """Close every device's pooled async client."""
+    for device in registry.all():
+        client, device._async_client = device._async_client, None
+        if client is not None:
+            await client.aclose()
+
+async def esp32_request_async(
+    method: str,
+    endpoint: str,
+    timeout: float = 5,
+    device: Optional[Device] = None,
+    payload: Optional[Any] = None,
+    content: Optional[bytes] = None
+):
+    """Send a request to an ESP32 endpoint without blocking the event loop.
+
+    `payload` is sent as JSON, `content` as a raw octet-stream body. Returns an
+    httpx or requests response; both expose `text`, `json()` and `raise_for_status()`.
+    Concurrent GETs of the same read-only endpoint share one request and response.
+    """
+    device = device or registry.get()
+    if method == "GET" and is_read_only(endpoint):
+        return await single_flight(
+            device, endpoint, lambda: _send_async(method, endpoint, timeout, device, None, None)
+        )
+    return await _send_async(method, endpoint, timeout, device, payload, content)
+
+def is_transport_failure(error: Exception) -> bool:
+    """True for timeouts and connection failures (the device may be offline).
+    
+    A connection dropped mid-response means the device is up (e.g. restarting).
+    """
+    return request_outcome(error) in ("timeout", "connection_error") and not is_connection_drop(error)
+
+def is_retryable(error: Exception, method: str, endpoint: str) -> bool:
+    """True if retrying cannot repeat a command: the request never reached the device,
+    or it was a read-only GET that timed out."""
+    if httpx is not None and isinstance(error, (httpx.ConnectError, httpx.ConnectTimeout)):
+        return True
+    if isinstance(error, requests.ConnectionError) and not isinstance(error, requests.ReadTimeout):
+        return not is_connection_drop(error)
+    return request_outcome(error) == "timeout" and method == "GET" and is_read_only(endpoint)
+
+def retry_delay(attempt: int, started: float) -> Optional[float]:
+    """Full-jitter backoff before retry `attempt`, or None if it would exceed RETRY_BUDGET."""
+    delay = random.uniform(0, RETRY_BACKOFF * 2 ** (attempt - 1))
+    if time.monotonic() - started + delay > RETRY_BUDGET:
+        return None
+    return delay
+
+async def _send_async(
+    method: str,
+    endpoint: str,
+    timeout: float,
+    device: Device,
+    payload: Optional[Any],
+    content: Optional[bytes]
+):
+    """Send through the device's circuit breaker, retrying transport failures within the budget."""
+    started = time.monotonic()
+    try:
+        if device.breaker.before_request():
+            await _probe_async(device)
+    except DeviceUnavailable as e:
+        record_request(device, endpoint, time.perf_counter(), error=e)
+        raise
+    
+    attempt = 0
+    while True:
+        try:
+            response = await _attempt_async(method, endpoint, timeout, device, payload, content)
+        except Exception as e:
+            if not is_transport_failure(e):
+                raise
+            device.breaker.record_failure()
+            attempt += 1
+            delay = retry_delay(attempt, started)
+            if delay is None or device.breaker.state != CircuitBreaker.CLOSED or not is_retryable(e, method, endpoint):
+                raise
+            logger.debug(f"Retrying {endpoint} on '{device.name}' in {delay:.3f}s: {describe_error(e)}")
+            await asyncio.sleep(delay)
+            continue
+        device.breaker.record_success()
+        return response
+
+async def _probe_async(device: Device) -> None:
+    """Half-open probe: a short /status request decides whether the breaker closes."""
+    try:
+        await _attempt_async("GET", "status", BREAKER_PROBE_TIMEOUT, device, None, None)
+    except Exception as e:
+        if is_transport_failure(e):
+            device.breaker.record_failure()
+            raise DeviceUnavailable(f"Device '{device.name}' is still unreachable: {describe_error(e)}") from e
+    except BaseException:
+        device.breaker.probe_aborted()  # Cancelled: leave the breaker open rather than half-open
+        raise
+    device.breaker.record_success()
+
+async def _attempt_async(
+    method: str,
+    endpoint: str,
+    timeout: float,
+    device: Device,
+    payload: Optional[Any],
+    content: Optional[bytes]
+):
+    """One HTTP round trip, recorded in DEVICE_METRICS."""
+    headers = {"Content-Type": "application/octet-stream"} if content is not None else None
+    started = time.perf_counter()
+    try:
+        if not ASYNC_TRANSPORT:
+            response = await asyncio.to_thread(
+                device.session().request, method, device.url(endpoint),
+                json=payload, data=content, headers=headers, timeout=timeout
+            )
+        else:
+            response = await device.async_client().request(
+                method, device.url(endpoint), json=payload, content=content, headers=headers, timeout=timeout
+            )
+    except Exception as e:
+        record_request(device, endpoint, started, error=e)
+        raise
+    record_request(device, endpoint, started, response=response)
+    return response
+
+def is_read_only(endpoint: str) -> bool:
+    """True if a GET to this endpoint has no side effects on the device."""
+    return endpoint.split("?", 1)[0] in READ_ONLY_ENDPOINTS
+
+async def single_flight(device: Device, key: str, call: Callable[[], Awaitable[Any]]) -> Any:
+    """Run call() once for all concurrent callers with the same key on a device.
+    
+    Callers that arrive while the request is in flight wait for it and share its
+    result (or exception). A cancelled caller does not cancel the shared request.
+    """
+    task = device.inflight.get(key)
+    if task is None:
+        task = asyncio.get_running_loop().create_task(call())
+        device.inflight[key] = task
+        task.add_done_callback(lambda _: device.inflight.pop(key, None))
+    return await asyncio.shield(task)
+
+def single_flight_sync(device: Device, key: str, call: Callable[[], Any]) -> Any:
+    """Thread-based counterpart of single_flight for the synchronous helpers."""
+    with device._lock:
+        flight = device.inflight_sync.get(key)
+        leader = flight is None
+        if leader:
+            flight = device.inflight_sync[key] = _SyncFlight()
+    
+    if not leader:
+        flight.done.wait()
+        if flight.error is not None:
+            raise flight.error
+        return flight.result
+    
+    try:
+        flight.result = call()
+        return flight.result
+    except Exception as e:
+        flight.error = e
+        raise
+    finally:
+        with device._lock:
+            device.inflight_sync.pop(key, None)
+        flight.done.set()
+
+async def esp32_get_async(endpoint: str, timeout: float = 5, device: Optional[Device] = None):
+    """GET an ESP32 endpoint without blocking the event loop."""
+    return await esp32_request_async("GET", endpoint, timeout, device)
+
+def describe_error(error: Exception) -> str:
+    """Readable error text (httpx transport errors often have an empty message)."""
+    return str(error) or error.__class__.__name__
+
+def is_connection_drop(error: Exception) -> bool:
+    """True if an error means the device closed the connection mid-request (e.g. on restart)."""
+    if httpx is not None and isinstance(error, (httpx.RemoteProtocolError, httpx.ReadError)):
+        return True
+    return "Connection reset" in str(error) or "Connection aborted" in str(error)
+
+def _with_cache_info(result: Dict[str, Any], age: float, hit: bool, stale: bool) -> Dict[str, Any]:
+    result = dict(result)
+    result["cache"] = {"hit": hit, "age_s": round(age, 3), "stale": stale}
+    return result
+
+async def cached_read(
+    device: Device,
+    endpoint: str,
+    fetch: Callable[[Device], Awaitable[Dict[str, Any]]]
+) -> Dict[str, Any]:
+    """Serve a read-only tool result from the device's cache (stale-while-revalidate).
+    
+    Fresh entries are returned as-is; stale ones are returned immediately while one
+    background refresh runs. Results include a "cache" block with the data's age.
+    """
+    ttl = CACHE_TTLS.get(endpoint, 0)
+    entry = device.cache.get(endpoint)
+    if entry is not None and ttl > 0:
+        age = time.monotonic() - entry[0]
+        if age < ttl:
+            return _with_cache_info(entry[1], age, True, False)
+        if age < ttl + CACHE_MAX_STALE:
+            if endpoint not in device.refreshing:
+                task = asyncio.get_running_loop().create_task(_refresh(device, endpoint, fetch))
+                device.refreshing[endpoint] = task
+            return _with_cache_info(entry[1], age, True, True)
+    
+    epoch = device.cache_epoch
+    result = await fetch(device)
+    if result.get("success") and ttl > 0 and epoch == device.cache_epoch:
+        device.cache[endpoint] = (time.monotonic(), result)
+    return _with_cache_info(result, 0, False, False)
+
+async def _refresh(device: Device, endpoint: str, fetch: Callable[[Device], Awaitable[Dict[str, Any]]]) -> None:
+    """Background refresh of a stale cache entry."""
+    try:
+        epoch = device.cache_epoch
+        result = await fetch(device)
+        if result.get("success") and epoch == device.cache_epoch:
+            device.cache[endpoint] = (time.monotonic(), result)
+    except Exception as e:
+        logger.warning(f"Cache refresh of {endpoint} on '{device.name}' failed: {describe_error(e)}")
+    finally:
+        device.refreshing.pop(endpoint, None)
+
+# Telemetry metrics sampled from each endpoint: metric name -> field in the JSON response
+TELEMETRY_METRICS = {
+    "memory": {"free": "free", "allocated": "allocated", "free_percent": "free_percent",
+               "fragmentation": "fragmentation"},
+    "status": {"queue_length": "queue_length"},
+}
+_telemetry_task: Optional[asyncio.Task] = None
+
+async def fetch_json(device: Device, endpoint: str, timeout: float = 5) -> Dict[str, Any]:
+    """GET an endpoint and decode its JSON body, raising on any failure."""
+    response = await esp32_get_async(endpoint, timeout=timeout, device=device)
+    response.raise_for_status()
+    return response.json()
+
+async def read_telemetry(device: Device, force_gc: bool = False) -> Dict[str, Any]:
+    """Status, memory and storage in one /telemetry call.
+    
+    Firmware without the combined endpoint answers 404; the sections are then
+    read from /status, /memory and /storage individually.
+    """
+    response = await esp32_get_async(f"telemetry?gc={int(force_gc)}", timeout=5, device=device)
+    if response.status_code != 404:
+        response.raise_for_status()
+        return response.json()
+    
+    data = {}
+    for endpoint in ("status", "memory", "storage"):
+        try:
+            data[endpoint] = await fetch_json(device, endpoint)
+        except Exception as e:
+            logger.debug(f"{endpoint} on '{device.name}' failed: {describe_error(e)}")
+    if not data:
+        raise RuntimeError("No telemetry endpoint answered")
+    return data
+
+async def sample_telemetry(device: Device) -> None:
+    """Take one telemetry sample from a device and append it to its ring buffer."""
+    try:
+        telemetry = await read_telemetry(device)
+    except Exception as e:
+        device.telemetry_errors += 1
+        logger.debug(f"Telemetry on '{device.name}' failed: {describe_error(e)}")
+        return
+    
+    sample: Dict[str, float] = {}
+    for endpoint, fields in TELEMETRY_METRICS.items():
+        data = telemetry.get(endpoint, {})
+        for metric, field in fields.items():
+            if isinstance(data.get(field), (int, float)):
+                sample[metric] = data[field]
+        if endpoint == "status" and "queue_latency_us" in data:
+            sample["queue_latency_us"] = data["queue_latency_us"].get("last", 0)
+    if sample:
+        device.telemetry.append((time.time(), sample))
+
+async def _telemetry_loop(interval: float) -> None:
+    """Poll every registered device at a fixed interval until cancelled."""
+    semaphore = asyncio.Semaphore(FANOUT_CONCURRENCY)
+    
+    async def sample(device: Device) -> None:
+        async with semaphore:
+            await sample_telemetry(device)
+    
+    while True:
+        started = time.monotonic()
+        await asyncio.gather(*(sample(d) for d in registry.all()), return_exceptions=True)
+        await asyncio.sleep(max(0.0, interval - (time.monotonic() - started)))
+
+def start_telemetry(interval: float) -> None:
+    """Start (or restart) the background telemetry poller."""
+    global _telemetry_task
+    stop_telemetry()
+    _telemetry_task = asyncio.get_running_loop().create_task(_telemetry_loop(interval))
+    logger.info(f"Telemetry polling every {interval}s")
+
+def stop_telemetry() -> None:
+    """Stop the background telemetry poller if it is running."""
+    global _telemetry_task
+    if _telemetry_task is not None:
+        _telemetry_task.cancel()
+        _telemetry_task = None
+
+def percentile(sorted_values: List[float], pct: float) -> float:
+    """Linear-interpolated percentile of an already sorted list."""
+    if len(sorted_values) == 1:
+        return sorted_values[0]
+    rank = (len(sorted_values) - 1) * pct / 100
+    low = int(rank)
+    high = min(low + 1, len(sorted_values) - 1)
+    return sorted_values[low] + (sorted_values[high] - sorted_values[low]) * (rank - low)
+
+def summarize_telemetry(device: Device, window_s: float, metric: Optional[str] = None) -> Dict[str, Any]:
+    """Min/max/mean/percentiles of a device's telemetry samples over the last window_s seconds."""
+    since = time.time() - window_s
+    samples = [m for t, m in device.telemetry if t >= since]
+    series: Dict[str, List[float]] = {}
+    for sample in samples:
+        for name, value in sample.items():
+            if metric is None or name == metric:
+                series.setdefault(name, []).append(value)
+    
+    stats = {}
+    for name, values in series.items():
+        ordered = sorted(values)
+        stats[name] = {
+            "min": ordered[0],
+            "max": ordered[-1],
+            "mean": round(sum(values) / len(values), 2),
+            "p50": round(percentile(ordered, 50), 2),
+            "p95": round(percentile(ordered, 95), 2),
+            "p99": round(percentile(ordered, 99), 2),
+            "latest": values[-1],
+        }
+    return {
+        "success": True,
+        "window_s": window_s,
+        "samples": len(samples),
+        "poll_errors": device.telemetry_errors,
+        "metrics": stats
+    }
+
+_events_task: Optional[asyncio.Task] = None
+
+# Open MCP sessions subscribed to each resource URI
+_subscriptions: Dict[str, set] = {}
+
+def state_uri(device: Device) -> str:
+    return f"esp32://devices/{device.name}/state"
+
+def notify_state(device: Device) -> None:
+    """Tell subscribed MCP sessions that a device's state resource changed."""
+    uri = state_uri(device)
+    for session in list(_subscriptions.get(uri, ())):
+        async def send(session=session) -> None:
+            try:
+                await session.send_resource_updated(uri)
+            except Exception:
+                _subscriptions.get(uri, set()).discard(session)  # Session has gone away
+        asyncio.get_running_loop().create_task(send())
+
+def apply_event(device: Device, kind: str, data: Dict[str, Any]) -> None:
+    """Update a device's state mirror from one /events message."""
+    mirror = device.mirror
+    if kind == "state":
+        mirror.clear()
+        mirror.update(data)
+    elif kind == "led":
+        mirror["led_state"] = data["state"]
+    elif kind == "job":
+        mirror["queue_length"] = data["queue_length"]
+        if data["state"] == "running":
+            mirror["running_job"] = data["id"]
+        elif data["state"] in JOB_FINISHED and mirror.get("running_job") == data["id"]:
+            mirror["running_job"] = None
+        mirror["last_job"] = {"id": data["id"], "state": data["state"]}
+    elif kind == "heap":
+        mirror["heap_free"] = data["free"]
+        mirror["heap_low_water"] = data["low_water"]
+    else:
+        return
+    device.mirror_at = time.monotonic()
+    notify_state(device)
+
+def drop_mirror(device: Device) -> None:
+    """Forget mirrored state, and the cached status that commands stopped invalidating."""
+    device.mirror.clear()
+    device.invalidate("status")
+
+async def _read_events(device: Device) -> None:
+    """Follow one /events connection, applying every message, until it drops."""
+    reader, writer = await asyncio.wait_for(asyncio.open_connection(device.ip, device.port), 5)
+    try:
+        writer.write(f"GET /events HTTP/1.1\r\nHost: {device.ip}\r\n\r\n".encode())
+        await writer.drain()
+        status_line = await asyncio.wait_for(reader.readline(), 5)
+        status = status_line.split()[1:2]
+        if status == [b"404"]:
+            device.events = "unsupported"  # Firmware without /events
+            return
+        if status != [b"200"]:
+            raise ConnectionError(f"/events answered {status_line.decode(errors='replace').strip()}")
+        while (await asyncio.wait_for(reader.readline(), 5)).strip():
+            pass  # Skip headers
+        
+        device.events = "live"
+        logger.info(f"Following events from ESP32 '{device.name}'")
+        kind, data = "message", []
+        while True:
+            line = await asyncio.wait_for(reader.readline(), EVENTS_READ_TIMEOUT)
+            if not line:
+                raise ConnectionError("Event stream closed")
+            line = line.decode().rstrip("\r\n")
+            if not line:
+                if data:
+                    apply_event(device, kind, json.loads("\n".join(data)))
+                kind, data = "message", []
+            elif not line.startswith(":"):
+                field, _, value = line.partition(":")
+                value = value[1:] if value.startswith(" ") else value
+                if field == "event":
+                    kind = value
+                elif field == "data":
+                    data.append(value)
+    finally:
+        writer.close()
+
+async def follow_events(device: Device) -> None:
+    """Keep a device's event stream connected, backing off while it is unreachable."""
+    delay = EVENTS_RECONNECT
+    while device.events != "unsupported":
+        device.events = "connecting"
+        try:
+            await _read_events(device)
+        except (OSError, asyncio.TimeoutError, ValueError, KeyError) as e:
+            logger.debug(f"Event stream from '{device.name}' ended: {describe_error(e)}")
+        if device.events == "live":
+            delay = EVENTS_RECONNECT
+        if device.mirror:
+            drop_mirror(device)  # Stale until the next snapshot
+            notify_state(device)
+        if device.events == "unsupported":
+            logger.info(f"ESP32 '{device.name}' has no /events endpoint; status will be polled")
+            return
+        device.events = "connecting"
+        await asyncio.sleep(delay)
+        delay = min(delay * 2, EVENTS_RECONNECT_MAX)
+
+async def _events_loop() -> None:
+    """Start a follower for every registered device, including ones added later."""
+    try:
+        while True:
+            for device in registry.all():
+                task = device.events_task
+                if (task is None or task.done()) and device.events != "unsupported":
+                    device.events_task = asyncio.get_running_loop().create_task(follow_events(device))
+            await asyncio.sleep(1)
+    finally:
+        for device in registry.all():
+            if device.events_task is not None:
+                device.events_task.cancel()
+                device.events_task = None
+            device.events = "off"
+            drop_mirror(device)
+
+def start_events() -> None:
+    """Start following device event streams."""
+    global _events_task
+    if _events_task is None or _events_task.done():
+        _events_task = asyncio.get_running_loop().create_task(_events_loop())
+        logger.info("Following device event streams")
+
+def stop_events() -> None:
+    global _events_task
+    if _events_task is not None:
+        _events_task.cancel()
+        _events_task = None
+
+def device_state(device: Device) -> Dict[str, Any]:
+    """A device's mirrored state, as served by its state resource."""
+    state = {"name": device.name, "events": device.events, "live": device.events_live()}
+    if device.events_live():
+        state["age_s"] = round(time.monotonic() - device.mirror_at, 3)
+        state.update(device.mirror)
+        state["name"] = device.name
+    return state
+
+def enable_resource_subscriptions(server: FastMCP) -> bool:
+    """Accept resources/subscribe so clients are notified when a device's state changes.
+    
+    FastMCP has no public hook for this, so the handlers go on the underlying MCP
+    server: newer SDKs register them with add_request_handler(), older ones with
+    the subscribe_resource()/unsubscribe_resource() decorators.
+    """
+    low = getattr(server, "_mcp_server", None)
+    if low is None:
+        return False
+    
+    def subscribe(uri: Any, session: Any) -> None:
+        _subscriptions.setdefault(str(uri), set()).add(session)
+    
+    def unsubscribe(uri: Any, session: Any) -> None:
+        _subscriptions.get(str(uri), set()).discard(session)
+    
+    if hasattr(low, "add_request_handler"):
+        import mcp.types as mcp_types
+        
+        async def on_subscribe(ctx, params):
+            subscribe(params.uri, ctx.session)
+            return mcp_types.EmptyResult()
+        
+        async def on_unsubscribe(ctx, params):
+            unsubscribe(params.uri, ctx.session)
+            return mcp_types.EmptyResult()
+        
+        low.add_request_handler("resources/subscribe", mcp_types.SubscribeRequestParams, on_subscribe)
+        low.add_request_handler("resources/unsubscribe", mcp_types.UnsubscribeRequestParams, on_unsubscribe)
+        return True
+    if hasattr(low, "subscribe_resource"):
+        @low.subscribe_resource()
+        async def on_subscribe(uri):
+            subscribe(uri, low.request_context.session)
+        
+        @low.unsubscribe_resource()
+        async def on_unsubscribe(uri):
+            unsubscribe(uri, low.request_context.session)
+        return True
+    return False
+
+class Metrics:
+    """Thread-safe call counters and latency histograms, keyed by label values."""
+    
+    def __init__(self, name: str, description: str, labels: Tuple[str, ...]):
+        self.name = name
+        self.description = description
+        self.labels = labels
+        self._series: Dict[Tuple[str, ...], List[float]] = {}  # labels -> bucket counts + [sum, count, max]
+        self._lock = threading.Lock()
+    
+    def observe(self, seconds: float, *label_values: str) -> None:
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [0] * len(METRICS_BUCKETS) + [0.0, 0, 0.0]
+            for i, bound in enumerate(METRICS_BUCKETS):
+                if seconds <= bound:
+                    series[i] += 1
+            series[-3] += seconds
+            series[-2] += 1
+            series[-1] = max(series[-1], seconds)
+    
+    def render(self) -> List[str]:
+        """Prometheus text exposition: a calls counter and a duration histogram."""
+        with self._lock:
+            items = sorted((k, list(v)) for k, v in self._series.items())
+        lines = [
+            f"# HELP {self.name}_calls_total {self.description} (count)",
+            f"# TYPE {self.name}_calls_total counter",
+        ]
+        for values, series in items:
+            lines.append(f"{self.name}_calls_total{{{_label_text(self.labels, values)}}} {series[-2]}")
+        lines += [
+            f"# HELP {self.name}_duration_seconds {self.description} (latency)",
+            f"# TYPE {self.name}_duration_seconds histogram",
+        ]
+        for values, series in items:
+            labels = _label_text(self.labels, values)
+            for bound, count in zip(METRICS_BUCKETS, series):
+                lines.append(f'{self.name}_duration_seconds_bucket{{{labels},le="{bound}"}} {count}')
+            lines.append(f'{self.name}_duration_seconds_bucket{{{labels},le="+Inf"}} {series[-2]}')
+            lines.append(f"{self.name}_duration_seconds_sum{{{labels}}} {series[-3]:.6f}")
+            lines.append(f"{self.name}_duration_seconds_count{{{labels}}} {series[-2]}")
+        return lines
+    
+    def summary(self) -> List[Dict[str, Any]]:
+        """Count, mean, approximate p95 (bucket upper bound) and max latency per label set."""
+        with self._lock:
+            items = sorted((k, list(v)) for k, v in self._series.items())
+        rows = []
+        for values, series in items:
+            count = series[-2]
+            p95 = next((b for b, c in zip(METRICS_BUCKETS, series) if c >= count * 0.95), None)
+            rows.append({
+                **dict(zip(self.labels, values)),
+                "calls": count,
+                "mean_ms": round(series[-3] / count * 1000, 1),
+                "p95_ms_le": p95 * 1000 if p95 is not None else None,
+                "max_ms": round(series[-1] * 1000, 1)
+            })
+        return rows
+
+def _label_text(names: Tuple[str, ...], values: Tuple[str, ...]) -> str:
+    escape = lambda v: str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+    return ",".join(f'{n}="{escape(v)}"' for n, v in zip(names, values))
+
+TOOL_METRICS = Metrics("esp32_mcp_tool", "MCP tool calls", ("tool", "outcome"))
+DEVICE_METRICS = Metrics("esp32_device_request", "HTTP requests to ESP32 devices", ("device", "endpoint", "outcome"))
+
+def metric_endpoint(endpoint: str) -> str:
+    """Endpoint label without query string or numeric IDs (jobs/42 -> jobs/:id)."""
+    return re.sub(r"/\d+(?=/|$)", "/:id", endpoint.split("?", 1)[0])
+
+def request_outcome(error: Optional[Exception] = None, status: int = 200) -> str:
+    """Classify a device request as success, http_error, timeout, connection_error or error."""
+    if error is None:
+        return "success" if status < 400 else "http_error"
+    if isinstance(error, DeviceUnavailable):
+        return "circuit_open"
+    if isinstance(error, (requests.Timeout, asyncio.TimeoutError)) or (
+            httpx is not None and isinstance(error, httpx.TimeoutException)):
+        return "timeout"
+    if isinstance(error, (requests.ConnectionError, ConnectionError)) or (
+            httpx is not None and isinstance(error, httpx.TransportError)):
+        return "connection_error"
+    return "error"
+
+def record_request(device: Device, endpoint: str, started: float, error: Optional[Exception] = None, response=None) -> None:
+    """Record one device round trip in DEVICE_METRICS."""
+    outcome = request_outcome(error, response.status_code if response is not None else 200)
+    DEVICE_METRICS.observe(time.perf_counter() - started, device.name, metric_endpoint(endpoint), outcome)
+
+def tool_outcome(result: Any) -> str:
+    """success, queue_full or error, from a tool's result dict."""
+    if not isinstance(result, dict) or result.get("success", True):
+        return "success"
+    return "queue_full" if result.get("queue_full") else "error"
+
+def timed_tool(func: Callable) -> Callable:
+    """Record a tool's latency and outcome in TOOL_METRICS (apply under @mcp.tool())."""
+    if asyncio.iscoroutinefunction(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            outcome = "exception"
+            try:
+                result = await func(*args, **kwargs)
+                outcome = tool_outcome(result)
+                return result
+            finally:
+                TOOL_METRICS.observe(time.perf_counter() - started, func.__name__, outcome)
+    else:
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            outcome = "exception"
+            try:
+                result = func(*args, **kwargs)
+                outcome = tool_outcome(result)
+                return result
+            finally:
+                TOOL_METRICS.observe(time.perf_counter() - started, func.__name__, outcome)
+    return wrapper
+
+def render_metrics() -> str:
+    """All metrics in Prometheus text format."""
+    return "\n".join(TOOL_METRICS.render() + DEVICE_METRICS.render()) + "\n"
+
+_metrics_server: Optional[http.server.ThreadingHTTPServer] = None
+
+def start_metrics_server(port: int) -> None:
+    """Serve /metrics on a standalone port from a daemon thread."""
+    global _metrics_server
+    if _metrics_server is not None:
+        return
+    
+    class Handler(http.server.BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?", 1)[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = render_metrics().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        
+        def log_message(self, format, *args):
+            pass
+    
+    _metrics_server = http.server.ThreadingHTTPServer(("0.0.0.0", port), Handler)
+    threading.Thread(target=_metrics_server.serve_forever, daemon=True).start()
+    logger.info(f"Serving metrics on http://0.0.0.0:{port}/metrics")
+
+@mcp.custom_route("/metrics", methods=["GET"])
+async def metrics_endpoint(request: Request) -> PlainTextResponse:
+    """Prometheus scrape endpoint when the server runs over HTTP (SSE / streamable HTTP)."""
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
+
+@mcp.resource("metrics://prometheus", mime_type="text/plain")
+def prometheus_metrics() -> str:
+    """Tool and device request counters and latency histograms in Prometheus text format."""
+    return render_metrics()
+
+@mcp.resource("esp32://devices/{name}/state", mime_type="application/json")
+def device_state_resource(name: str) -> Dict[str, Any]:
+    """Live LED, queue and heap state of a device, mirrored from its event stream.
+    
+    Subscribe to be notified of every change (requires ESP32_EVENTS=true).
+    """
+    return device_state(registry.get(name))
+
+enable_resource_subscriptions(mcp)
+
+@mcp.resource("metrics://summary", mime_type="application/json")
+def metrics_summary() -> Dict[str, Any]:
+    """Calls, mean, approximate p95 and max latency per tool and per device endpoint."""
+    return {"tools": TOOL_METRICS.summary(), "devices": DEVICE_METRICS.summary()}
+
+async def for_devices(
+    device: Optional[str],
+    group: Optional[str],
+    action: Callable[[Device], Awaitable[Dict[str, Any]]]
+) -> Dict[str, Any]:
+    """Run a per-device action on one device, or concurrently across a group.
+    
+    Group fan-out is bounded by ESP32_FANOUT_CONCURRENCY and reports each
+    device's result and timing.
+    """
+    if not group:
+        try:
+            target = registry.get(device)
+        except KeyError as e:
+            return {"success": False, "error": str(e.args[0])}
+        return await action(target)
+    
+    devices = registry.select(group)
+    if not devices:
+        return {"success": False, "error": f"No devices in group '{group}'"}
+    
+    semaphore = asyncio.Semaphore(FANOUT_CONCURRENCY)
+    
+    async def run(target: Device) -> Dict[str, Any]:
+        async with semaphore:
+            start = time.perf_counter()
+            try:
+                result = await action(target)
+            except Exception as e:
+                result = {"success": False, "error": describe_error(e)}
+            result["elapsed_ms"] = round((time.perf_counter() - start) * 1000, 1)
+            return result
+    
+    start = time.perf_counter()
+    results = await asyncio.gather(*(run(d) for d in devices))
+    return {
+        "success": all(r.get("success", False) for r in results),
+        "group": group,
+        "elapsed_ms": round((time.perf_counter() - start) * 1000, 1),
+        "results": {d.name: r for d, r in zip(devices, results)}
+    }
 
 @mcp.tool()
-def blink_led(count: int = 3, interval_ms: int = 200) -> Dict[str, Any]:
-    """Blink the ESP32 LED a number of times with a specified interval (ms)."""
+@timed_tool
+async def blink_led(
+    count: int = 3,
+    interval_ms: int = 200,
+    device: Optional[str] = None,
+    group: Optional[str] = None,
+    progress: bool = False,
+    ctx: Optional[Context] = None
+) -> Dict[str, Any]:
+    """Blink the ESP32 LED a number of times with a specified interval (ms).
+    
+    Target a registered device by name, or every device in a group ("all" for the whole fleet).
+    With progress=True, wait until the blinks have played, sending an MCP progress
+    notification after each one.
+    """
     endpoint = f"led/blink?count={count}&interval={interval_ms}"
-    return call_esp32(endpoint)
+    args = pack_args(">HH", count, interval_ms)
+    result = await for_devices(device, group, lambda d: send_command(d, endpoint, CMD_BLINK, args))
+    if progress:
+        result = await report_job_progress(ctx, device, result, count, "blinks")
+    return result
 
 @mcp.tool()
-def restart_device() -> Dict[str, Any]:
-    """Restart the ESP32 device."""
+@timed_tool
+async def restart_device(device: Optional[str] = None, group: Optional[str] = None) -> Dict[str, Any]:
+    """Restart the ESP32 device (or every device in a group)."""
+    return await for_devices(device, group, _restart_device)
+
+async def _restart_device(device: Device) -> Dict[str, Any]:
     endpoint = "restart"
+    device.invalidate()
     try:
         # The ESP32 will restart immediately after sending the response,
         # so we use a shorter timeout and handle the potential connection reset
-        response = requests.get(
-            f"http://{ESP32_IP}:{ESP32_PORT}/{endpoint}",
-            timeout=2
-        )
+        response = await esp32_get_async(endpoint, timeout=2, device=device)
         # This line will only be reached if the device doesn't restart immediately
         return {"success": True, "message": response.text.strip()}
-    except requests.exceptions.RequestException as e:
+    except Exception as e:
         # If the device restarts, the connection will be reset
-        if "Connection reset" in str(e) or "Connection aborted" in str(e):
+        if is_connection_drop(e):
             return {"success": True, "message": "Device is restarting..."}
-        return {"success": False, "error": str(e)}
+        return {"success": False, "error": describe_error(e)}
+
+@mcp.tool()
+@timed_tool
+async def restart_and_wait(
+    timeout_s: float = 30,
+    device: Optional[str] = None,
+    group: Optional[str] = None
+) -> Dict[str, Any]:
+    """Restart the ESP32 (or every device in a group) and wait until it accepts commands again.
+    
+    Unlike restart_device, the board is ready when this returns: its command queue is
+    running, pooled connections are open and status, memory and storage are cached.
+    Reports the measured downtime and the board's own boot timings.
+    
+    Args:
+        timeout_s: Give up on a device that is not back after this many seconds (default: 30)
+    """
+    return await for_devices(device, group, lambda d: _restart_and_wait(d, timeout_s))
+
+async def _restart_and_wait(device: Device, timeout_s: float) -> Dict[str, Any]:
+    if MOCK_MODE:
+        return {"success": True, "message": "Mock restart", "downtime_ms": 0.0}
+    
+    restarted = await _restart_device(device)
+    if not restarted.get("success"):
+        return restarted
+    requested = time.monotonic()
+    deadline = requested + timeout_s
+    # Pooled connections belong to the old boot, and probes that fail while the board
+    # is down must not open the breaker for everyone else
+    device.close()
+    device.breaker.reset()
+    
+    interval = RESTART_POLL_MIN
+    probes = 0
+    seen_down = False
+    first_answer = None
+    while True:
+        probes += 1
+        status = None
+        try:
+            timeout = max(0.05, min(RESTART_PROBE_TIMEOUT, deadline - time.monotonic()))
+            response = await _attempt_async("GET", "status", timeout, device, None, None)
+            response.raise_for_status()
+            status = response.json()
+        except Exception:
+            seen_down = True  # Not back yet
+        
+        now = time.monotonic()
+        if isinstance(status, dict):
+            # The old boot can still answer in the moment before it resets
+            uptime_ms = status.get("uptime_ms")
+            rebooted = seen_down or (isinstance(uptime_ms, int) and uptime_ms <= (now - requested) * 1000)
+            if rebooted:
+                first_answer = first_answer or now
+                if status.get("queue_running"):
+                    break
+                interval = RESTART_POLL_MIN  # Answering, so the queue is moments away
+        else:
+            interval = min(interval * 1.5, RESTART_POLL_MAX)
+        
+        if now + interval >= deadline:
+            return {"success": False, "probes": probes,
+                    "answering": first_answer is not None,
+                    "error": f"Device did not become ready within {timeout_s}s of restarting"}
+        await asyncio.sleep(interval)
+    
+    device.breaker.record_success()
+    device.invalidate()
+    device.cache["status"] = (time.monotonic(), {"success": True, "status": status})
+    # Concurrent reads open the pool's connections along with filling the caches
+    warmed = await asyncio.gather(
+        cached_read(device, "memory", _get_memory_usage),
+        cached_read(device, "storage", _get_storage_info)
+    )
+    return {
+        "success": True,
+        "message": "Device restarted and ready",
+        "downtime_ms": round((now - requested) * 1000, 1),
+        "first_answer_ms": round((first_answer - requested) * 1000, 1),
+        "probes": probes,
+        "boot_ms": status.get("boot_ms"),
+        "warmed": ["status"] + [name for name, result in zip(("memory", "storage"), warmed) if result.get("success")]
+    }
+
+@mcp.tool()
+@timed_tool
+async def cancel_command(
+    job_id: Optional[int] = None,
+    clear_queue: bool = False,
+    device: Optional[str] = None,
+    group: Optional[str] = None
+) -> Dict[str, Any]:
+    """Stop the LED effect that is playing now, leaving the LED in its last on/off state.
+    
+    Args:
+        job_id: Cancel only this job, whether it is running or still queued
+        clear_queue: Also drop every queued command ("stop everything")
+        device: Name of a registered device (default device if omitted)
+        group: Cancel on every device in this group ("all" for every device)
+    """
+    query = {"clear": int(clear_queue)}
+    if job_id is not None:
+        query["job"] = job_id
+    endpoint = f"cancel?{urllib.parse.urlencode(query)}"
+    return await for_devices(device, group, lambda d: _queue_control(d, endpoint))
+
+@mcp.tool()
+@timed_tool
+async def clear_queue(device: Optional[str] = None, group: Optional[str] = None) -> Dict[str, Any]:
+    """Drop every queued LED command that has not started; the running one finishes normally."""
+    return await for_devices(device, group, lambda d: _queue_control(d, "queue/clear"))
+
+async def _queue_control(device: Device, endpoint: str) -> Dict[str, Any]:
+    result = await call_esp32_async(endpoint, device)
+    if result.get("success") and not MOCK_MODE:
+        try:
+            # {"cancelled": <running job ID or null>, "dropped": <queued commands removed>}
+            result.update(json.loads(result.pop("message")))
+        except ValueError:
+            pass
+    return result
 
 @mcp.tool()
-def get_memory_usage() -> Dict[str, Any]:
-    """Get memory usage statistics from the ESP32."""
+@timed_tool
+async def get_memory_usage(device: Optional[str] = None, group: Optional[str] = None) -> Dict[str, Any]:
+    """Get memory usage statistics from the ESP32 (or every device in a group).
+    
+    Results may come from a short-lived cache; see the "cache" field for their age.
+    """
+    return await for_devices(device, group, lambda d: cached_read(d, "memory", _get_memory_usage))
+
+async def _get_memory_usage(device: Device) -> Dict[str, Any]:
     endpoint = "memory"
     try:
-        response = requests.get(
-            f"http://{ESP32_IP}:{ESP32_PORT}/{endpoint}",
-            timeout=5
-        )
+        response = await esp32_get_async(endpoint, timeout=5, device=device)
         response.raise_for_status()
         memory_data = response.json()
         
@@ -71,17 +1448,21 @@ def get_memory_usage() -> Dict[str, Any]:
             }
         }
     except Exception as e:
-        return {"success": False, "error": str(e)}
+        return {"success": False, "error": describe_error(e)}
 
 @mcp.tool()
-def get_storage_info() -> Dict[str, Any]:
-    """Get storage information from the ESP32's filesystem."""
+@timed_tool
+async def get_storage_info(device: Optional[str] = None, group: Optional[str] = None) -> Dict[str, Any]:
+    """Get storage information from the ESP32's filesystem (or every device in a group).
+    
+    Results may come from a short-lived cache; see the "cache" field for their age.
+    """
+    return await for_devices(device, group, lambda d: cached_read(d, "storage", _get_storage_info))
+
+async def _get_storage_info(device: Device) -> Dict[str, Any]:
     endpoint = "storage"
     try:
-        response = requests.get(
-            f"http://{ESP32_IP}:{ESP32_PORT}/{endpoint}",
-            timeout=5
-        )
+        response = await esp32_get_async(endpoint, timeout=5, device=device)
         response.raise_for_status()
         storage_data = response.json()
         
@@ -104,43 +1485,339 @@ def get_storage_info() -> Dict[str, Any]:
             }
         }
     except Exception as e:
-        return {"success": False, "error": str(e)}
+        return {"success": False, "error": describe_error(e)}
+
+def command_result(response) -> Dict[str, Any]:
+    """Tool result for a device response, with the job ID of any queued command.
+    
+    A full command queue (HTTP 429) is reported with the device's queue depth
+    rather than raised, so callers can back off and retry.
+    """
+    if response.status_code == 429:
+        try:
+            queue = response.json()
+        except ValueError:
+            queue = {}
+        return queue_full_result(queue.get("queue_length"), queue.get("queue_size"),
+                                 float(response.headers.get("Retry-After", 1)))
+    response.raise_for_status()
+    result = {"success": True, "message": response.text.strip()}
+    job_ids = response.headers.get("X-Job-Id")
+    if job_ids:
+        ids = [int(j) for j in job_ids.split(",")]
+        result["job_id"] = ids[-1]  # Commands run in order, so the last one finishes last
+        if len(ids) > 1:
+            result["job_ids"] = ids
+    return result
+
+def queue_full_result(queue_length: Optional[int], queue_size: Optional[int], retry_after_s: float = 1.0) -> Dict[str, Any]:
+    return {
+        "success": False,
+        "error": "Device command queue is full",
+        "queue_full": True,
+        "queue_length": queue_length,
+        "queue_size": queue_size,
+        "retry_after_s": retry_after_s
+    }
+
+# Messages the firmware's HTTP routes return, so both transports give the same results
+BINARY_MESSAGES = {
+    CMD_LED_ON: "LED ON",
+    CMD_LED_OFF: "LED OFF",
+    CMD_MORSE: "Morse code queued",
+    CMD_BLINK: "Blink queued",
+    CMD_PULSE: "Pulse queued",
+    CMD_TIMELINE: "Timeline queued",
+}
+
+def pack_args(fmt: str, *values: int) -> Optional[bytes]:
+    """Pack binary frame arguments, or None if a value does not fit (HTTP then reports it)."""
+    try:
+        return struct.pack(fmt, *values)
+    except struct.error:
+        return None
+
+def binary_result(opcode: int, status: int, payload: bytes) -> Dict[str, Any]:
+    """Tool result for a binary acknowledgement, shaped like command_result's."""
+    if status == BIN_OK:
+        return {"success": True, "message": BINARY_MESSAGES.get(opcode, "Queued"),
+                "job_id": struct.unpack(">I", payload[:4])[0]}
+    if status == BIN_QUEUE_FULL:
+        return queue_full_result(*struct.unpack(">HH", payload[:4]))
+    return {"success": False, "error": payload.decode("utf-8", "replace") or f"Binary command failed ({status})"}
 
-def call_esp32(endpoint: str) -> Dict[str, Any]:
-    """Helper function to make HTTP requests to the ESP32"""
+async def call_binary(device: Device, endpoint: str, opcode: int, args: bytes) -> Optional[Dict[str, Any]]:
+    """Send one command frame; None if the device does not answer on the binary port at all."""
+    if not device.events_live():
+        device.invalidate("status")
+    device.invalidate("telemetry")
+    label = f"bin:{endpoint}"
+    probing = False
+    if device.binary == "ok":
+        try:
+            probing = device.breaker.before_request()  # When half-open, this frame is the probe
+        except DeviceUnavailable as e:
+            record_request(device, label, time.perf_counter(), error=e)
+            return {"success": False, "error": describe_error(e)}
+    
+    started = time.perf_counter()
+    try:
+        channel = await device.binary_channel()
+        status, payload = await channel.request(opcode, args)
+    except (OSError, asyncio.TimeoutError) as e:
+        record_request(device, label, started, error=e)
+        if device.binary is None:
+            # Never acknowledged anything: firmware without the binary protocol, or a lost packet
+            device.binary_failures += 1
+            if isinstance(e, ConnectionRefusedError) or device.binary_failures >= BINARY_PROBE_FAILURES:
+                device.binary = "unsupported"
+                logger.info(f"ESP32 '{device.name}' does not answer binary commands; using HTTP")
+            else:
+                device.binary_retry_at = time.monotonic() + BINARY_REPROBE_DELAY
+                logger.info(f"ESP32 '{device.name}' did not acknowledge a binary command; "
+                            f"using HTTP for {BINARY_REPROBE_DELAY:.0f}s")
+            return None
+        device.breaker.record_failure()
+        return {"success": False, "error": f"Binary command not acknowledged: {describe_error(e)}"}
+    except BaseException:
+        if probing:
+            device.breaker.probe_aborted()
+        raise
+    record_request(device, label, started)
+    device.binary = "ok"
+    device.binary_failures = 0
+    device.breaker.record_success()
+    return binary_result(opcode, status, payload)
+
+async def send_command(
+    device: Device,
+    endpoint: str,
+    opcode: int,
+    args: Optional[bytes],
+    content: Optional[bytes] = None
+) -> Dict[str, Any]:
+    """Queue an LED command over the device's transport.
+    
+    Binary-transport devices get a UDP frame carrying opcode and args (None when the
+    command has no binary form); everything else goes to the HTTP endpoint.
+    """
+    if (device.transport == "binary" and args is not None and device.binary != "unsupported"
+            and time.monotonic() >= device.binary_retry_at
+            and not MOCK_MODE and len(args) + 5 <= BINARY_MAX_FRAME):
+        result = await call_binary(device, endpoint, opcode, args)
+        if result is not None:
+            return result
+    return await call_esp32_async(endpoint, device, content=content)
+
+async def follow_job(
+    device: Device,
+    job_id: int,
+    on_progress: Callable[[Dict[str, Any]], Awaitable[None]]
+) -> Dict[str, Any]:
+    """Long-poll /jobs/<id> until the job finishes, passing each progress change to on_progress.
+    
+    Returns the job's final JSON. Firmware without progress counters only answers
+    when the job finishes (or the wait expires), so on_progress is never called.
+    """
+    done = -1
+    while True:
+        response = await esp32_get_async(
+            f"jobs/{job_id}?wait={JOB_WAIT_MS}&since={done}", timeout=JOB_WAIT_MS / 1000 + 5, device=device
+        )
+        if response.status_code == 404:
+            raise LookupError("Unknown job (the device may have restarted)")
+        response.raise_for_status()
+        job = response.json()
+        progress = job.get("progress")
+        if progress is not None and progress["done"] != done:
+            done = progress["done"]
+            await on_progress(progress)
+        if job["state"] in JOB_FINISHED:
+            return job
+
+async def report_job_progress(
+    ctx: Optional[Context],
+    device: Optional[str],
+    result: Dict[str, Any],
+    total: int,
+    unit: str,
+    convert: Callable[[Dict[str, Any]], int] = lambda progress: progress["done"]
+) -> Dict[str, Any]:
+    """Wait for the jobs a command tool queued, sending MCP progress notifications as they play.
+    
+    `result` is the tool's result for `device` or a group; progress is summed over
+    its devices, `total` units per device. `convert` maps the firmware's progress
+    counters to units (e.g. timeline steps to Morse characters). Each device's result
+    gains the job's final "state" and "progress".
+    """
+    queued = result["results"].items() if "results" in result else [(device, result)]
+    targets = [(registry.get(name), r) for name, r in queued if r.get("success") and r.get("job_id") is not None]
+    done = {d.name: 0 for d, _ in targets}
+    reported: List[int] = []
+    
+    async def report() -> None:
+        sent, expected = sum(done.values()), total * len(done)
+        if ctx is None or reported == [sent]:
+            return  # Several firmware steps can make up one unit (e.g. a Morse character)
+        reported[:] = [sent]
+        try:
+            await ctx.report_progress(sent, expected, f"{sent}/{expected} {unit}")
+        except TypeError:
+            await ctx.report_progress(sent, expected)  # FastMCP before 2.9 takes no message
+    
+    async def follow(device: Device, r: Dict[str, Any]) -> None:
+        async def on_progress(progress: Dict[str, Any]) -> None:
+            done[device.name] = min(convert(progress), total)
+            await report()
+        try:
+            job = await follow_job(device, r["job_id"], on_progress)
+            if job["state"] == "done":
+                done[device.name] = total
+            r["state"] = job["state"]
+        except Exception as e:
+            r["state"] = None
+            r["progress_error"] = describe_error(e)
+        r["progress"] = {"done": done[device.name], "total": total, "unit": unit}
+    
+    await report()
+    await asyncio.gather(*(follow(d, r) for d, r in targets))
+    if targets:
+        await report()
+    return result
+
+def _send_sync(method: str, endpoint: str, timeout: float, device: Device):
+    """Blocking counterpart of _send_async (circuit breaker, retries and metrics)."""
+    started = time.monotonic()
+    try:
+        if device.breaker.before_request():
+            try:
+                _attempt_sync("GET", "status", BREAKER_PROBE_TIMEOUT, device)
+            except Exception as e:
+                if is_transport_failure(e):
+                    device.breaker.record_failure()
+                    raise DeviceUnavailable(f"Device '{device.name}' is still unreachable: {describe_error(e)}") from e
+            except BaseException:
+                device.breaker.probe_aborted()
+                raise
+            device.breaker.record_success()
+    except DeviceUnavailable as e:
+        record_request(device, endpoint, time.perf_counter(), error=e)
+        raise
+    
+    attempt = 0
+    while True:
+        try:
+            response = _attempt_sync(method, endpoint, timeout, device)
+        except Exception as e:
+            if not is_transport_failure(e):
+                raise
+            device.breaker.record_failure()
+            attempt += 1
+            delay = retry_delay(attempt, started)
+            if delay is None or device.breaker.state != CircuitBreaker.CLOSED or not is_retryable(e, method, endpoint):
+                raise
+            time.sleep(delay)
+            continue
+        device.breaker.record_success()
+        return response
+
+def _attempt_sync(method: str, endpoint: str, timeout: float, device: Device):
+    started = time.perf_counter()
+    try:
+        response = device.session().request(method, device.url(endpoint), timeout=timeout)
+    except Exception as e:
+        record_request(device, endpoint, started, error=e)
+        raise
+    record_request(device, endpoint, started, response=response)
+    return response
+
+def call_esp32(endpoint: str, device: Optional[str] = None) -> Dict[str, Any]:
+    """Helper function to make HTTP requests to the ESP32 (synchronous)"""
     if MOCK_MODE:
         logger.info(f"[MOCK] Would call: {endpoint}")
         return {"success": True, "message": f"Mock call to {endpoint}"}
     
-    url = f"http://{ESP32_IP}:{ESP32_PORT}/{endpoint}"
     try:
-        response = requests.get(url, timeout=5)
-        response.raise_for_status()
-        return {"success": True, "message": response.text.strip()}
+        target = registry.get(device)
+        
+        def get():
+            return _send_sync("GET", endpoint, 5, target)
+        
+        response = single_flight_sync(target, endpoint, get) if is_read_only(endpoint) else get()
+        return command_result(response)
     except Exception as e:
-        logger.error(f"Error calling ESP32: {str(e)}")
-        return {"success": False, "error": str(e)}
+        logger.error(f"Error calling ESP32: {describe_error(e)}")
+        return {"success": False, "error": describe_error(e)}
+
+async def call_esp32_async(
+    endpoint: str,
+    device: Optional[Device] = None,
+    payload: Optional[Any] = None,
+    content: Optional[bytes] = None
+) -> Dict[str, Any]:
+    """Async counterpart of call_esp32 used by the MCP tools (POSTs when a payload or content is given)"""
+    if MOCK_MODE:
+        logger.info(f"[MOCK] Would call: {endpoint}")
+        return {"success": True, "message": f"Mock call to {endpoint}"}
+    
+    try:
+        device = device or registry.get()
+        if not is_read_only(endpoint):
+            # Anything other than a cached read may change the LED or queue state.
+            # With a live event stream, status reads overlay those fields from the mirror.
+            if not device.events_live():
+                device.invalidate("status")
+            device.invalidate("telemetry")
+        method = "GET" if payload is None and content is None else "POST"
+        response = await esp32_request_async(
+            method, endpoint, timeout=5, device=device, payload=payload, content=content
+        )
+        return command_result(response)
+    except Exception as e:
+        logger.error(f"Error calling ESP32: {describe_error(e)}")
+        result = {"success": False, "error": describe_error(e)}
+        response = getattr(e, "response", None)
+        if response is not None:
+            result["status_code"] = response.status_code  # Lets callers fall back on e.g. 404
+        return result
 
 @mcp.tool()
-def turn_led_on() -> Dict[str, Any]:
-    """Turn on the LED on the ESP32 device."""
-    global mock_led_state
+@timed_tool
+async def turn_led_on(device: Optional[str] = None, group: Optional[str] = None) -> Dict[str, Any]:
+    """Turn on the LED on the ESP32 device (or every device in a group)."""
     logger.info("Turning LED ON")
-    
+    return await for_devices(device, group, lambda d: _set_led(d, True))
+
+async def _set_led(device: Device, on: bool) -> Dict[str, Any]:
     if MOCK_MODE:
-        mock_led_state = True
-        return {"success": True, "message": "LED turned ON (mock mode)"}
+        device.mock_led_state = on
+        device.invalidate("status")
+        return {"success": True, "message": f"LED turned {'ON' if on else 'OFF'} (mock mode)"}
     
-    return call_esp32("led/on")
+    return await send_command(device, "led/on" if on else "led/off", CMD_LED_ON if on else CMD_LED_OFF, b"")
 
 @mcp.tool()
-def pulse_led(speed: int = 20, min_duty: int = 0, max_duty: int = 1023, times: int = 1) -> Dict[str, Any]:
+@timed_tool
+async def pulse_led(
+    speed: int = 20,
+    min_duty: int = 0,
+    max_duty: int = 1023,
+    times: int = 1,
+    device: Optional[str] = None,
+    group: Optional[str] = None,
+    progress: bool = False,
+    ctx: Optional[Context] = None
+) -> Dict[str, Any]:
     """Pulse the LED with a smooth breathing effect.
     
     Args:
         speed: Controls the speed of the pulse (lower is faster, default: 20)
         min_duty: Minimum brightness (0-1023, default: 0)
         max_duty: Maximum brightness (0-1023, default: 1023)
+        times: Number of times to repeat the pulse (default: 1)
+        device: Name of a registered device (default device if omitted)
+        group: Run on every device in this group concurrently ("all" for every device)
+        progress: Wait until the pulses have played, sending an MCP progress notification after each one (default: False)
     """
     logger.info(f"Starting LED pulse with speed={speed}, min={min_duty}, max={max_duty}")
     
@@ -149,33 +1826,64 @@ def pulse_led(speed: int = 20, min_duty: int = 0, max_duty: int = 1023, times: i
     
     # Pass through the times parameter to the ESP32
     endpoint = f"led/pulse?speed={speed}&min={min_duty}&max={max_duty}&times={times}"
-    return call_esp32(endpoint)
+    args = pack_args(">HHHH", speed, min_duty, max_duty, times)
+    result = await for_devices(device, group, lambda d: send_command(d, endpoint, CMD_PULSE, args))
+    if progress:
+        result = await report_job_progress(ctx, device, result, times, "pulses")
+    return result
 
 @mcp.tool()
-def turn_led_off() -> Dict[str, Any]:
-    """Turn off the LED on the ESP32 device."""
-    global mock_led_state
+@timed_tool
+async def turn_led_off(device: Optional[str] = None, group: Optional[str] = None) -> Dict[str, Any]:
+    """Turn off the LED on the ESP32 device (or every device in a group)."""
     logger.info("Turning LED OFF")
-    
-    if MOCK_MODE:
-        mock_led_state = False
-        return {"success": True, "message": "LED turned OFF (mock mode)"}
-    
-    return call_esp32("led/off")
+    return await for_devices(device, group, lambda d: _set_led(d, False))
 
 @mcp.tool()
-def get_esp32_status() -> Dict[str, Any]:
-    """Get the current status of the ESP32 device."""
+@timed_tool
+async def get_esp32_status(device: Optional[str] = None, group: Optional[str] = None) -> Dict[str, Any]:
+    """Get the current status of the ESP32 device (or every device in a group).
+    
+    Results may come from a short-lived cache; see the "cache" field for their age.
+    With event streaming on, LED and queue fields come from the live state mirror.
+    """
     logger.info("Getting ESP32 status")
+    return await for_devices(device, group, read_status)
+
+async def read_status(device: Device) -> Dict[str, Any]:
+    """Status from the cache, with LED/queue/heap fields overlaid from a live event mirror.
+    
+    The rest of the status (uptime, latency, Wi-Fi) ages like any cached read: it is
+    marked stale after its TTL and refreshed in the background.
+    """
+    result = await cached_read(device, "status", _get_esp32_status)
+    if not device.events_live() or not result.get("success") or not isinstance(result.get("status"), dict):
+        return result
     
+    mirror = device.mirror
+    status = dict(result["status"])
+    read_job = status.get("running_job")
+    for key in ("led_state", "queue_length", "running_job"):
+        if key in mirror:
+            status[key] = mirror[key]
+    for key in ("heap_free", "heap_low_water", "last_job"):
+        if mirror.get(key) is not None:
+            status[key] = mirror[key]
+    if status.get("progress") is not None and status.get("running_job") != read_job:
+        status["progress"] = None  # Belonged to a command that has finished since the last read
+    result = dict(result, status=status)
+    result["live"] = {"source": "events", "age_s": round(time.monotonic() - device.mirror_at, 3)}
+    return result
+
+async def _get_esp32_status(device: Device) -> Dict[str, Any]:
     if MOCK_MODE:
         return {
             "success": True,
             "status": {
-                "led_state": "ON" if mock_led_state else "OFF",
+                "led_state": "ON" if device.mock_led_state else "OFF",
                 "mode": "MOCK",
-                "ip_address": ESP32_IP,
-                "port": ESP32_PORT,
+                "ip_address": device.ip,
+                "port": device.port,
                 "threads": {
                     "active": 1,
                     "total_created": 1
@@ -184,7 +1892,12 @@ def get_esp32_status() -> Dict[str, Any]:
         }
     
     # Get the status from the ESP32
-    status = call_esp32("status")
+    status = await call_esp32_async("status", device)
+    if status.get("success", False):
+        try:
+            status = {"success": True, "status": json.loads(status["message"])}
+        except ValueError:
+            pass  # Not JSON; return the raw message
     
     if status.get("success", False) and "threads" in status.get("status", {}):
         # If we already have thread info in the response, just return it
@@ -204,27 +1917,284 @@ class IPConfig(BaseModel):
     port: Optional[int] = 80
 
 @mcp.tool()
-def set_esp32_ip(ip: str, port: int = 80) -> Dict[str, Any]:
-    """Set the IP address and port of the ESP32 device."""
-    global ESP32_IP, ESP32_PORT
-    ESP32_IP = ip
-    ESP32_PORT = port
+@timed_tool
+def set_esp32_ip(ip: str, port: int = 80, device: Optional[str] = None) -> Dict[str, Any]:
+    """Set the IP address and port of the ESP32 device (the default device unless named)."""
+    target = registry.add(device or DeviceRegistry.DEFAULT, ip, port)
     
-    logger.info(f"ESP32 IP set to {ESP32_IP}:{ESP32_PORT}")
+    logger.info(f"ESP32 '{target.name}' IP set to {target.ip}:{target.port}")
     return {
         "success": True,
-        "message": f"ESP32 IP address set to {ESP32_IP}:{ESP32_PORT}"
+        "message": f"ESP32 IP address set to {target.ip}:{target.port}"
     }
 
+@mcp.tool()
+@timed_tool
+def register_device(
+    name: str, ip: str, port: int = 80, groups: Optional[List[str]] = None, transport: Optional[str] = None
+) -> Dict[str, Any]:
+    """Register (or update) a named ESP32 device, optionally assigning it to groups.
+    
+    transport: "http", or "binary" to send LED commands as compact UDP frames
+    """
+    try:
+        target = registry.add(name, ip, port, groups, transport)
+    except ValueError as e:
+        return {"success": False, "error": str(e)}
+    logger.info(f"Registered ESP32 '{name}' at {ip}:{port}")
+    return {"success": True, "device": target.describe()}
+
+@mcp.tool()
+@timed_tool
+def remove_device(name: str) -> Dict[str, Any]:
+    """Remove a named ESP32 device from the registry."""
+    try:
+        registry.remove(name)
+    except KeyError:
+        return {"success": False, "error": f"Unknown device '{name}'"}
+    return {"success": True, "message": f"Removed device '{name}'"}
+
+@mcp.tool()
+@timed_tool
+def list_devices(group: Optional[str] = None) -> Dict[str, Any]:
+    """List registered ESP32 devices, optionally only those in a group."""
+    devices = registry.select(group) if group else registry.all()
+    return {"success": True, "devices": [d.describe() for d in devices]}
+
+_discovery_cache: Dict[Tuple, Tuple[float, List[Dict[str, Any]]]] = {}
+
+async def probe_status(ip: str, port: int, timeout: float) -> Optional[Dict[str, Any]]:
+    """GET /status on a fresh connection; the parsed body if it looks like this firmware."""
+    async def fetch() -> bytes:
+        reader, writer = await asyncio.open_connection(ip, port)
+        try:
+            writer.write(f"GET /status HTTP/1.0\r\nHost: {ip}\r\n\r\n".encode())
+            await writer.drain()
+            # HTTP/1.0: the device closes the connection after the response, which may arrive in pieces
+            raw = b""
+            while len(raw) <= DISCOVERY_MAX_RESPONSE:
+                chunk = await reader.read(8192)
+                if not chunk:
+                    break
+                raw += chunk
+            return raw
+        finally:
+            writer.close()
+    
+    try:
+        raw = await asyncio.wait_for(fetch(), timeout)
+        head, _, body = raw.partition(b"\r\n\r\n")
+        if head.split(b"\r\n", 1)[0].split()[1:2] != [b"200"]:
+            return None
+        status = json.loads(body)
+    except (OSError, asyncio.TimeoutError, ValueError):
+        return None
+    if not isinstance(status, dict) or not STATUS_SIGNATURE <= status.keys():
+        return None
+    return status
+
+class _DiscoveryProtocol(asyncio.DatagramProtocol):
+    """Collects (ip, announcement) replies to a discovery broadcast."""
+    
+    def __init__(self):
+        self.replies: List[Tuple[str, Dict[str, Any]]] = []
+    
+    def datagram_received(self, data: bytes, addr: Tuple[str, int]) -> None:
+        try:
+            announcement = json.loads(data)
+        except ValueError:
+            return
+        if isinstance(announcement, dict) and announcement.get("service") == "esp32-led":
+            self.replies.append((addr[0], announcement))
+
+async def broadcast_discovery(timeout: float) -> List[Tuple[str, Dict[str, Any]]]:
+    """Broadcast a discovery probe and collect the replies that arrive within timeout."""
+    loop = asyncio.get_running_loop()
+    transport, protocol = await loop.create_datagram_endpoint(
+        _DiscoveryProtocol, local_addr=("0.0.0.0", 0), allow_broadcast=True)
+    try:
+        transport.sendto(DISCOVERY_MAGIC, (DISCOVERY_ADDRESS, DISCOVERY_PORT))
+        await asyncio.sleep(timeout)
+    finally:
+        transport.close()
+    return protocol.replies
+
+async def find_devices(
+    cidr: Optional[str], ports: List[int], broadcast: bool, timeout: float
+) -> List[Dict[str, Any]]:
+    """Devices answering the broadcast or found in the CIDR range, verified via /status."""
+    candidates: Dict[Tuple[str, int], str] = {}  # (ip, port) -> how it was found
+    if broadcast:
+        try:
+            for ip, announcement in await broadcast_discovery(timeout):
+                candidates[(ip, int(announcement.get("http_port", 80)))] = "broadcast"
+        except OSError as e:
+            logger.warning(f"Discovery broadcast failed: {e}")
+    if cidr:
+        for host in ipaddress.ip_network(cidr, strict=False).hosts():
+            for port in ports:
+                candidates.setdefault((str(host), port), "scan")
+    
+    semaphore = asyncio.Semaphore(DISCOVERY_CONCURRENCY)
+    
+    async def check(ip: str, port: int) -> Optional[Dict[str, Any]]:
+        async with semaphore:
+            status = await probe_status(ip, port, timeout)
+        if status is None:
+            return None
+        return {"name": status.get("name") or f"esp32-{ip.replace('.', '-')}-{port}",
+                "ip": ip, "port": port, "found_by": candidates[(ip, port)],
+                "led_state": status.get("led_state"), "queue_length": status.get("queue_length")}
+    
+    found = await asyncio.gather(*(check(ip, port) for ip, port in candidates))
+    # A board reachable at several addresses reports the same name; keep one entry per
+    # name, preferring the address it answered the broadcast from, and list every address
+    # so one that is already registered can be matched
+    by_name: Dict[str, Dict[str, Any]] = {}
+    for entry in sorted((f for f in found if f is not None),
+                        key=lambda f: (f["found_by"] != "broadcast", ipaddress.ip_address(f["ip"]), f["port"])):
+        first = by_name.setdefault(entry["name"], dict(entry, addresses=[]))
+        first["addresses"].append([entry["ip"], entry["port"]])
+    return sorted(by_name.values(), key=lambda f: f["name"])
+
+def registered_device(found: Dict[str, Any]) -> Optional[Device]:
+    """The registered device at any of the addresses a discovered board answered on."""
+    addresses = {tuple(a) for a in found.get("addresses", [])} | {(found["ip"], found["port"])}
+    for device in registry.all():
+        if (device.ip, device.port) in addresses:
+            return device
+    return None
+
+def register_discovered(found: Dict[str, Any]) -> str:
+    """Add a discovered device to the registry; returns "new", "moved" or "known"."""
+    if registered_device(found) is not None:
+        return "known"
+    try:
+        registry.get(found["name"])
+    except KeyError:
+        registry.add(found["name"], found["ip"], found["port"], ["discovered"])
+        logger.info(f"Discovered ESP32 '{found['name']}' at {found['ip']}:{found['port']}")
+        return "new"
+    registry.add(found["name"], found["ip"], found["port"])  # Same board, new address; keep its groups
+    logger.info(f"ESP32 '{found['name']}' moved to {found['ip']}:{found['port']}")
+    return "moved"
+
+@mcp.tool()
+@timed_tool
+async def discover_devices(
+    cidr: Optional[str] = None,
+    ports: Optional[List[int]] = None,
+    broadcast: bool = True,
+    timeout_s: float = 0.5,
+    register: bool = True,
+    refresh: bool = False
+) -> Dict[str, Any]:
+    """Find ESP32 devices on the network instead of setting addresses by hand.
+    
+    Args:
+        cidr: Address range to scan, e.g. "192.168.1.0/24" (optional)
+        ports: HTTP ports to try on each scanned address (default: [80])
+        broadcast: Also send a UDP discovery broadcast that devices answer directly
+        timeout_s: How long to wait for broadcast replies and for each /status probe
+        register: Add newly found devices to the registry (group "discovered")
+        refresh: Ignore results cached from an identical recent search
+    """
+    ports = sorted(set(ports or [80]))
+    if not cidr and not broadcast:
+        return {"success": False, "error": "Give a cidr to scan and/or enable broadcast"}
+    try:
+        targets = ipaddress.ip_network(cidr, strict=False).num_addresses * len(ports) if cidr else 0
+    except ValueError as e:
+        return {"success": False, "error": f"Invalid cidr: {e}"}
+    if targets > DISCOVERY_MAX_TARGETS:
+        return {"success": False, "error": f"Range too large ({targets} address/port pairs, "
+                                           f"limit {DISCOVERY_MAX_TARGETS})"}
+    
+    key = (cidr, tuple(ports), broadcast)
+    cached = _discovery_cache.get(key)
+    started = time.monotonic()
+    if cached is not None and not refresh and started - cached[0] < DISCOVERY_CACHE_TTL:
+        found, age = cached[1], started - cached[0]
+    else:
+        found, age = await find_devices(cidr, ports, broadcast, timeout_s), None
+        _discovery_cache[key] = (time.monotonic(), found)
+    
+    devices = []
+    for entry in found:
+        entry = dict(entry)
+        known = registered_device(entry)
+        if known is not None:
+            # Report the board at the address it is already registered under
+            entry.update(ip=known.ip, port=known.port, registered_as=known.name)
+        if register:
+            entry["registry"] = register_discovered(entry)
+        devices.append(entry)
+    result = {"success": True, "devices": devices, "count": len(devices),
+              "elapsed_ms": round((time.monotonic() - started) * 1000, 1)}
+    if age is not None:
+        result["cached"] = True
+        result["age_s"] = round(age, 1)
+    return result
+
+
+def compile_morse(
+    message: str,
+    dot_duration: int = 100,
+    dash_duration: int = 300,
+    element_gap: int = 100,
+    letter_gap: int = 300,
+    word_gap: int = 700,
+    boundaries: Optional[List[int]] = None
+) -> array.array:
+    """Compile a message into an on/off timeline for the firmware's /timeline endpoint.
+    
+    The result alternates LED-on and LED-off hold times in milliseconds, starting
+    with "on". Consecutive gaps are merged, and unknown characters are skipped
+    just like the firmware does. If given, `boundaries` receives the number of hold
+    times played by the end of each character, to map timeline progress to characters.
+    """
+    timeline: List[int] = []
+    
+    def hold_off(ms: int) -> None:
+        if not timeline:
+            timeline.extend([0, 0])
+        timeline[-1] += ms
+        # Split gaps that do not fit in a uint16 with a zero-length "on"
+        while timeline[-1] > 0xFFFF:
+            timeline[-1] -= 0xFFFF
+            timeline[-1:] = [0xFFFF, 0, timeline[-1]]
+    
+    for char in message.upper():
+        code = MORSE_CODE_DICT.get(char)
+        if char == ' ':
+            hold_off(word_gap)
+        elif code is not None:
+            for i, element in enumerate(code):
+                timeline.extend([dot_duration if element == '.' else dash_duration, 0])
+                if i < len(code) - 1:
+                    hold_off(element_gap)
+            hold_off(letter_gap)
+        if boundaries is not None:
+            boundaries.append(len(timeline))
+    
+    packed = array.array('H', timeline)
+    if sys.byteorder == 'big':
+        packed.byteswap()  # The firmware reads little-endian values
+    return packed
 
 @mcp.tool()
-def flash_morse_code(
+@timed_tool
+async def flash_morse_code(
     message: str = Field(..., description="Text message to flash in Morse code"),
     dot_duration: int = Field(100, description="Duration of a dot in milliseconds (default: 100)"),
     dash_duration: int = Field(300, description="Duration of a dash in milliseconds (default: 300)"),
     element_gap: int = Field(100, description="Gap between elements in milliseconds (default: 100)"),
     letter_gap: int = Field(300, description="Gap between letters in milliseconds (default: 300)"),
-    word_gap: int = Field(700, description="Gap between words in milliseconds (default: 700)")
+    word_gap: int = Field(700, description="Gap between words in milliseconds (default: 700)"),
+    device: Optional[str] = Field(None, description="Name of a registered device (default device if omitted)"),
+    group: Optional[str] = Field(None, description="Flash on every device in this group concurrently (\"all\" for every device)"),
+    progress: bool = Field(False, description="Wait until the message has played, sending an MCP progress notification per character"),
+    ctx: Optional[Context] = None
 ) -> Dict[str, Any]:
     """Flash a message in Morse code using the ESP32's LED.
     
@@ -235,6 +2205,9 @@ def flash_morse_code(
         element_gap: Gap between elements of the same letter (default: 100)
         letter_gap: Gap between letters (default: 300)
         word_gap: Gap between words (default: 700)
+        device: Name of a registered device (default device if omitted)
+        group: Flash on every device in this group concurrently ("all" for every device)
+        progress: Wait until the message has played, reporting characters sent as MCP progress (default: False)
     """
     logger.info(f"Flashing Morse code: {message}")
     
@@ -250,7 +2223,19 @@ def flash_morse_code(
         }
     
     try:
-        # Encode the message for URL
+        durations = (dot_duration, dash_duration, element_gap, letter_gap, word_gap)
+        if any(not 0 <= d <= 0xFFFF for d in durations):
+            return {"success": False, "error": "Durations must be between 0 and 65535 ms"}
+        
+        # Compile the message into a packed timeline so the device only has to play it
+        boundaries: List[int] = []
+        timeline = compile_morse(message, *durations, boundaries=boundaries)
+        if not timeline:
+            return {"success": False, "error": "Message contains no Morse code characters"}
+        content = timeline.tobytes()
+        duration_ms = sum(timeline)
+        
+        # Encode the message for URL (fallback for firmware without /timeline)
         encoded_message = urllib.parse.quote_plus(message)
         
         # Build the endpoint URL with parameters
@@ -263,16 +2248,228 @@ def flash_morse_code(
             f"&word_gap={word_gap}"
         )
         
-        # Call the ESP32
-        return call_esp32(endpoint)
+        args = struct.pack(">H", 1023) + content  # Binary frame: on duty, then the timeline
+        
+        async def flash(d: Device) -> Dict[str, Any]:
+            if len(content) > TIMELINE_MAX_BYTES:
+                result = await call_esp32_async(endpoint, d)
+            else:
+                result = await send_command(d, "timeline", CMD_TIMELINE, args, content=content)
+                # No /timeline (older firmware), or a smaller body limit than expected
+                if not result["success"] and result.get("status_code") in (404, 413):
+                    result = await call_esp32_async(endpoint, d)
+            result["duration_ms"] = duration_ms
+            return result
+        
+        # Call the ESP32 (or every device in the group)
+        result = await for_devices(device, group, flash)
+        if progress:
+            # Timeline steps map to characters; firmware playing /morse itself counts characters
+            def characters(p: Dict[str, Any]) -> int:
+                return bisect.bisect_right(boundaries, p["done"]) if p["unit"] == "steps" else p["done"]
+            result = await report_job_progress(ctx, device, result, len(boundaries), "characters", characters)
+        return result
     except Exception as e:
         logger.error(f"Error flashing Morse code: {str(e)}")
+        return {"success": False, "error": describe_error(e)}
+
+def step_int(step: Dict[str, Any], name: str, default: int, maximum: int = 0xFFFF) -> int:
+    """An integer step argument from 0 to maximum; numeric strings such as "3" are converted."""
+    value = step.get(name, default)
+    if isinstance(value, bool) or not isinstance(value, (int, float, str)):
+        raise ValueError(f"{name} must be an integer, got {value!r}")
+    try:
+        number = int(value)
+    except ValueError:
+        raise ValueError(f"{name} must be an integer, got {value!r}") from None
+    if number != value and str(number) != str(value).strip():
+        raise ValueError(f"{name} must be an integer, got {value!r}")
+    if not 0 <= number <= maximum:
+        raise ValueError(f"{name} must be between 0 and {maximum}, got {number}")
+    return number
+
+def sequence_to_commands(steps: List[Dict[str, Any]]) -> List[List[Any]]:
+    """Translate run_sequence steps into the firmware's [CMD_*, args...] batch format.
+    
+    Arguments are checked (and numeric strings converted) here, since the firmware
+    rejects a whole batch over one bad value.
+    """
+    commands = []
+    for step in steps:
+        action = step.get("action")
+        if action == "on":
+            commands.append([CMD_LED_ON])
+        elif action == "off":
+            commands.append([CMD_LED_OFF])
+        elif action == "blink":
+            commands.append([CMD_BLINK, step_int(step, "count", 3), step_int(step, "interval_ms", 200)])
+        elif action == "pulse":
+            commands.append([
+                CMD_PULSE,
+                step_int(step, "speed", 20),
+                step_int(step, "min_duty", 0, 1023),
+                step_int(step, "max_duty", 1023, 1023),
+                step_int(step, "times", 1)
+            ])
+        elif action == "morse":
+            if not isinstance(step.get("message"), str) or not step["message"]:
+                raise ValueError("Morse step requires a message string")
+            commands.append([CMD_MORSE, step["message"], {
+                "dot_duration": step_int(step, "dot_duration", 100),
+                "dash_duration": step_int(step, "dash_duration", 300),
+                "element_gap": step_int(step, "element_gap", 100),
+                "letter_gap": step_int(step, "letter_gap", 300),
+                "word_gap": step_int(step, "word_gap", 700)
+            }])
+        else:
+            raise ValueError(f"Unknown action: {action}")
+    return commands
+
+@mcp.tool()
+@timed_tool
+async def run_sequence(
+    steps: List[Dict[str, Any]],
+    device: Optional[str] = None,
+    group: Optional[str] = None
+) -> Dict[str, Any]:
+    """Queue a sequence of LED steps in a single request so they play back to back.
+    
+    Each step is an object with an "action" and that action's parameters:
+    - {"action": "on"} / {"action": "off"}
+    - {"action": "blink", "count": 3, "interval_ms": 200}
+    - {"action": "pulse", "speed": 20, "min_duty": 0, "max_duty": 1023, "times": 1}
+    - {"action": "morse", "message": "SOS", "dot_duration": 100, ...}
+    
+    The whole sequence is queued atomically: if it does not fit in the device's
+    command queue, nothing is queued.
+    """
+    logger.info(f"Running sequence of {len(steps)} steps")
+    try:
+        commands = sequence_to_commands(steps)
+    except ValueError as e:
         return {"success": False, "error": str(e)}
+    
+    return await for_devices(device, group, lambda d: call_esp32_async("batch", d, {"commands": commands}))
+
+@mcp.tool()
+@timed_tool
+async def get_telemetry(
+    force_gc: bool = False,
+    device: Optional[str] = None,
+    group: Optional[str] = None
+) -> Dict[str, Any]:
+    """Get status, memory and storage from the ESP32 in a single request (or every device in a group).
+    
+    Args:
+        force_gc: Run a garbage collection on the device first for exact memory numbers
+        device: Name of a registered device (default device if omitted)
+        group: Query every device in this group ("all" for every device)
+    """
+    async def fetch(d: Device) -> Dict[str, Any]:
+        try:
+            return {"success": True, **(await read_telemetry(d, force_gc))}
+        except Exception as e:
+            return {"success": False, "error": describe_error(e)}
+    
+    if force_gc:
+        return await for_devices(device, group, fetch)
+    return await for_devices(device, group, lambda d: cached_read(d, "telemetry", fetch))
+
+@mcp.tool()
+@timed_tool
+async def get_telemetry_stats(
+    window_s: float = 300,
+    metric: Optional[str] = None,
+    device: Optional[str] = None,
+    group: Optional[str] = None
+) -> Dict[str, Any]:
+    """Summarize telemetry collected by the background poller, without contacting the device.
+    
+    Args:
+        window_s: Look-back window in seconds (default: 300)
+        metric: Only this metric (free, allocated, free_percent, fragmentation,
+            queue_length, queue_latency_us); all metrics if omitted
+        device: Name of a registered device (default device if omitted)
+        group: Summarize every device in this group ("all" for every device)
+    """
+    async def summarize(d: Device) -> Dict[str, Any]:
+        result = summarize_telemetry(d, window_s, metric)
+        if _telemetry_task is None:
+            result["note"] = "Telemetry polling is off; start it with set_telemetry_polling"
+        return result
+    
+    return await for_devices(device, group, summarize)
+
+@mcp.tool()
+@timed_tool
+async def set_telemetry_polling(interval_s: float) -> Dict[str, Any]:
+    """Start background telemetry polling every interval_s seconds, or stop it with 0."""
+    if interval_s <= 0:
+        stop_telemetry()
+        return {"success": True, "message": "Telemetry polling stopped"}
+    start_telemetry(interval_s)
+    return {"success": True, "message": f"Polling telemetry every {interval_s}s"}
+
+@mcp.tool()
+@timed_tool
+async def set_event_streaming(enabled: bool) -> Dict[str, Any]:
+    """Start or stop following every device's /events stream for live state."""
+    if not enabled:
+        stop_events()
+        return {"success": True, "message": "Event streaming stopped"}
+    if MOCK_MODE:
+        return {"success": False, "error": "Event streaming is not available in mock mode"}
+    start_events()
+    return {"success": True, "message": "Following device event streams"}
+
+@mcp.tool()
+@timed_tool
+async def wait_for_command(job_id: int, timeout_s: float = 30, device: Optional[str] = None) -> Dict[str, Any]:
+    """Wait until a queued LED command has finished playing (or was cancelled) on the device.
+    
+    LED tools return a job_id for each queued command; chain steps by waiting on
+    it instead of sleeping for a guessed duration.
+    
+    Args:
+        job_id: The job_id returned by turn_led_on, blink_led, pulse_led, flash_morse_code, run_sequence, ...
+        timeout_s: Give up after this many seconds (default: 30)
+        device: Name of the device the command was sent to (default device if omitted)
+    """
+    try:
+        d = registry.get(device)
+    except KeyError as e:
+        return {"success": False, "error": str(e.args[0])}
+    
+    started = time.monotonic()
+    deadline = started + timeout_s
+    state = None
+    try:
+        while True:
+            wait_ms = int(max(0, min(JOB_WAIT_MS / 1000, deadline - time.monotonic())) * 1000)
+            response = await esp32_get_async(f"jobs/{job_id}?wait={wait_ms}", timeout=wait_ms / 1000 + 5, device=d)
+            if response.status_code == 404:
+                return {"success": False, "job_id": job_id, "error": "Unknown job (the device may have restarted)"}
+            response.raise_for_status()
+            state = response.json()["state"]
+            if state in JOB_FINISHED or time.monotonic() >= deadline:
+                break
+    except Exception as e:
+        return {"success": False, "job_id": job_id, "error": describe_error(e)}
+    
+    waited_ms = round((time.monotonic() - started) * 1000, 1)
+    if state not in JOB_FINISHED:
+        return {"success": False, "job_id": job_id, "state": state, "waited_ms": waited_ms,
+                "error": f"Job still {state} after {timeout_s}s"}
+    if state == "failed":
+        return {"success": False, "job_id": job_id, "state": state, "waited_ms": waited_ms,
+                "error": "The command failed on the device"}
+    return {"success": True, "job_id": job_id, "state": state, "waited_ms": waited_ms}
 
 
 if __name__ == "__main__":
     logger.info("Starting ESP32 LED Controller MCP Server")
     logger.info(f"Default ESP32 IP: {ESP32_IP}:{ESP32_PORT}")
+    logger.info(f"Registered devices: {', '.join(d.name for d in registry.all())}")
     logger.info("Server starting...")
     
     # Start the MCP server
@@ -0,0 +1,328 @@
+#!/usr/bin/env python3
+"""
+ESP32 firmware simulator.
+
+Runs esp32_firmware_micropython/main.py unchanged on CPython by installing
+stand-ins for the MicroPython-only modules and functions it uses:
+
+- machine.Pin / PWM / Timer / reset (PWM duty changes are recorded)
+- network.WLAN (always connected on 127.0.0.1, with a MAC address derived from the port)
+- time.sleep_ms / ticks_ms / ticks_us / ticks_add / ticks_diff (with 30-bit wraparound)
+- gc.mem_free / gc.mem_alloc, select.poll returning socket objects, asyncio.sleep_ms
+
+CPython's own _thread, socket, os.statvfs and collections.deque are used as-is.
+Each simulated device is one process serving HTTP on its own local port;
+`--devices N` launches N of them on consecutive ports.
+"""
+
+import argparse
+import asyncio
+import gc
+import json
+import os
+import re
+import select
+import signal
+import subprocess
+import sys
+import threading
+import time
+import types
+
+FIRMWARE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "esp32_firmware_micropython", "main.py")
+
+# MicroPython tick counters wrap at 2**30
+TICKS_PERIOD = 1 << 30
+TICKS_MAX = TICKS_PERIOD - 1
+TICKS_HALF = TICKS_PERIOD // 2
+
+# Heap reported by gc.mem_free/mem_alloc (roughly a stock ESP32 MicroPython build)
+HEAP_SIZE = 111168
+HEAP_ALLOCATED = 20000
+
+
+class PWMRecorder:
+    """Writes every PWM duty change as an 'ms since boot,duty' line."""
+
+    def __init__(self, path=None):
+        self._file = open(path, "a", buffering=1) if path else None
+
+    def record(self, duty):
+        if self._file is not None:
+            self._file.write(f"{round((time.monotonic() - BOOT) * 1000, 3)},{duty}\n")
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+BOOT = time.monotonic()
+recorder = PWMRecorder()
+
+
+def _ticks(scale):
+    return lambda: int((time.monotonic() - BOOT) * scale) & TICKS_MAX
+
+
+def install_time_shims():
+    time.sleep_ms = lambda ms: time.sleep(ms / 1000)
+    time.sleep_us = lambda us: time.sleep(us / 1_000_000)
+    time.ticks_ms = _ticks(1000)
+    time.ticks_us = _ticks(1_000_000)
+    time.ticks_add = lambda ticks, delta: (ticks + delta) & TICKS_MAX
+    time.ticks_diff = lambda end, start: ((end - start + TICKS_HALF) & TICKS_MAX) - TICKS_HALF
+    asyncio.sleep_ms = lambda ms: asyncio.sleep(ms / 1000)
+
+
+def install_gc_shims(heap_size=HEAP_SIZE, allocated=HEAP_ALLOCATED):
+    gc.mem_free = lambda: heap_size - allocated
+    gc.mem_alloc = lambda: allocated
+
+
+def install_machine_shim():
+    machine = types.ModuleType("machine")
+
+    class Pin:
+        IN = 0
+        OUT = 1
+
+        def __init__(self, pin_id, mode=-1, *args, **kwargs):
+            self.id = pin_id
+            self._value = 0
+
+        def value(self, value=None):
+            if value is None:
+                return self._value
+            self._value = value
+
+    class PWM:
+        def __init__(self, pin, freq=1000, duty=0):
+            self.pin = pin
+            self._freq = freq
+            self._duty = duty
+
+        def freq(self, value=None):
+            if value is None:
+                return self._freq
+            self._freq = value
+
+        def duty(self, value=None):
+            if value is None:
+                return self._duty
+            self._duty = value
+            recorder.record(value)
+
+        def deinit(self):
+            pass
+
+    class Timer:
+        """machine.Timer on a daemon thread, calling back on a drift-free schedule."""
+        ONE_SHOT = 0
+        PERIODIC = 1
+
+        def __init__(self, timer_id=-1):
+            self.id = timer_id
+            self._stop = threading.Event()
+
+        def init(self, mode=PERIODIC, period=1000, callback=None, freq=None):
+            self.deinit()
+            stop = self._stop = threading.Event()
+            interval = 1 / freq if freq else period / 1000
+
+            def run():
+                deadline = time.monotonic()
+                while not stop.is_set():
+                    deadline += interval
+                    delay = deadline - time.monotonic()
+                    if delay > 0 and stop.wait(delay):
+                        break
+                    callback(self)
+                    if mode == Timer.ONE_SHOT:
+                        break
+
+            threading.Thread(target=run, daemon=True).start()
+
+        def deinit(self):
+            self._stop.set()
+
+    def reset():
+        """Reboot: re-exec this simulator process so the firmware starts from scratch."""
+        recorder.close()
+        sys.stdout.flush()
+        os.execv(sys.executable, [sys.executable] + sys.argv)
+
+    machine.Pin = Pin
+    machine.PWM = PWM
+    machine.Timer = Timer
+    machine.reset = reset
+    machine.freq = lambda *args: 240_000_000
+    sys.modules["machine"] = machine
+
+
+def install_network_shim(mac=b"\x24\x0a\xc4\x00\x00\x00"):
+    network = types.ModuleType("network")
+    network.STA_IF = 0
+    network.AP_IF = 1
+
+    class WLAN:
+        def __init__(self, interface=0):
+            self._active = False
+
+        def active(self, value=None):
+            if value is None:
+                return self._active
+            self._active = value
+
+        def connect(self, ssid=None, password=None):
+            pass
+
+        def isconnected(self):
+            return True
+
+        def ifconfig(self):
+            return ("127.0.0.1", "255.0.0.0", "127.0.0.1", "127.0.0.1")
+
+        def config(self, name):
+            if name == "mac":
+                return mac
+            raise ValueError("unknown config param")
+
+    network.WLAN = WLAN
+    sys.modules["network"] = network
+
+
+def install_select_shim():
+    """MicroPython's poll() returns the registered objects, CPython's returns file descriptors."""
+    cpython_poll = select.poll
+
+    class Poll:
+        def __init__(self):
+            self._poll = cpython_poll()
+            self._objects = {}
+
+        def register(self, obj, eventmask=select.POLLIN):
+            self._objects[obj.fileno()] = obj
+            self._poll.register(obj, eventmask)
+
+        def modify(self, obj, eventmask):
+            self._poll.modify(obj, eventmask)
+
+        def unregister(self, obj):
+            fd = obj.fileno()
+            if fd >= 0:
+                self._objects.pop(fd, None)
+                self._poll.unregister(fd)
+
+        def poll(self, timeout=-1):
+            return [(self._objects[fd], event) for fd, event in self._poll.poll(timeout) if fd in self._objects]
+
+    select.poll = Poll
+
+
+def load_firmware(path, overrides):
+    """Read main.py and replace top-level `NAME = value` constants (e.g. HTTP_PORT)."""
+    with open(path) as f:
+        source = f.read()
+    for name, value in overrides.items():
+        source, count = re.subn(rf"^{name} = [^#\n]*", f"{name} = {value} ", source, count=1, flags=re.M)
+        if not count:
+            raise SystemExit(f"{path} has no top-level constant {name}")
+    return source
+
+
+def run_device(args):
+    """Run one simulated device in this process until it is killed."""
+    global recorder
+    install_time_shims()
+    install_gc_shims(args.heap_size, args.heap_allocated)
+    install_machine_shim()
+    install_network_shim(mac=b"\x24\x0a\xc4" + args.port.to_bytes(3, "big"))
+    install_select_shim()
+    recorder = PWMRecorder(args.pwm_log)
+
+    if args.quiet:
+        sys.stdout = open(os.devnull, "w")
+    if args.boot_delay:
+        time.sleep(args.boot_delay)
+
+    # Binary commands use the UDP port with the HTTP port's number, so fleets do not collide
+    overrides = {"HTTP_PORT": args.port, "BINARY_PORT": args.port}
+    if args.asyncio:
+        overrides["USE_ASYNCIO"] = True
+    for item in args.set:
+        name, _, value = item.partition("=")
+        overrides[name] = value
+
+    code = compile(load_firmware(args.firmware, overrides), args.firmware, "exec")
+    module = {"__name__": "__main__", "__file__": args.firmware}
+    try:
+        exec(code, module)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        recorder.close()
+
+
+def run_fleet(args):
+    """Launch one simulator process per device and print the matching ESP32_DEVICES setting."""
+    devices = {}
+    children = []
+    for i in range(args.devices):
+        port = args.port + i
+        name = f"{args.name_prefix}{i}"
+        command = [sys.executable, os.path.abspath(__file__), "--port", str(port), "--firmware", args.firmware]
+        if args.asyncio:
+            command.append("--asyncio")
+        if args.quiet:
+            command.append("--quiet")
+        if args.boot_delay:
+            command += ["--boot-delay", str(args.boot_delay)]
+        if args.pwm_log:
+            command += ["--pwm-log", args.pwm_log.replace("{port}", str(port))]
+        for item in args.set:
+            command += ["--set", item]
+        children.append(subprocess.Popen(command))
+        devices[name] = {"ip": "127.0.0.1", "port": port, "groups": ["sim"], "binary_port": port}
+
+    print(f"ESP32_DEVICES='{json.dumps(devices)}'", flush=True)
+
+    def stop(*_):
+        for child in children:
+            child.terminate()
+
+    signal.signal(signal.SIGTERM, stop)
+    try:
+        for child in children:
+            child.wait()
+    except KeyboardInterrupt:
+        stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the ESP32 MicroPython firmware on CPython")
+    parser.add_argument("--port", type=int, default=8080, help="HTTP port (first port with --devices)")
+    parser.add_argument("--devices", type=int, default=1, help="Number of simulated devices on consecutive ports")
+    parser.add_argument("--name-prefix", default="sim", help="Device name prefix printed for ESP32_DEVICES")
+    parser.add_argument("--firmware", default=os.path.normpath(FIRMWARE), help="Path to main.py")
+    parser.add_argument("--asyncio", action="store_true", help="Run the firmware with USE_ASYNCIO = True")
+    parser.add_argument("--set", action="append", default=[], metavar="NAME=VALUE",
+                        help="Override a top-level firmware constant, e.g. --set QUEUE_SIZE=50")
+    parser.add_argument("--pwm-log", help="Append 'ms,duty' lines for every PWM change to this file "
+                                          "({port} is replaced with the device port)")
+    parser.add_argument("--boot-delay", type=float, default=0, help="Seconds to wait before booting (and after each reset)")
+    parser.add_argument("--heap-size", type=int, default=HEAP_SIZE, help="Heap size reported by gc")
+    parser.add_argument("--heap-allocated", type=int, default=HEAP_ALLOCATED, help="Allocated bytes reported by gc")
+    parser.add_argument("--quiet", action="store_true", help="Discard the firmware's console output")
+    args = parser.parse_args()
+
+    if args.devices > 1:
+        run_fleet(args)
+    else:
+        if args.pwm_log:
+            args.pwm_log = args.pwm_log.replace("{port}", str(args.port))
+        run_device(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+"""Tests for pure helpers of the MicroPython firmware, run on CPython.
+
+main.py starts Wi-Fi and the web server at import time, so the helpers under
+test are compiled on their own from its source.
+"""
+
+import ast
+import os
+
+import pytest
+
+FIRMWARE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "esp32_firmware_micropython", "main.py")
+
+
+def firmware_names(*names):
+    """Top-level functions and constants from main.py, without running the rest of it."""
+    with open(FIRMWARE) as f:
+        tree = ast.parse(f.read())
+    wanted = []
+    for node in tree.body:
+        if isinstance(node, ast.FunctionDef) and node.name in names:
+            wanted.append(node)
+        elif isinstance(node, ast.Assign) and any(getattr(t, "id", None) in names for t in node.targets):
+            wanted.append(node)
+    namespace = {}
+    exec(compile(ast.Module(body=wanted, type_ignores=[]), FIRMWARE, "exec"), namespace)
+    return namespace
+
+
+url_decode = firmware_names("HEX_DIGITS", "url_decode")["url_decode"]
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("hello+world", "hello world"),
+    ("SOS%20SOS", "SOS SOS"),
+    ("%C3%A9t%C3%A9", "été"),
+    ("%2b%2B", "++"),
+])
+def test_url_decode_escapes(text, expected):
+    assert url_decode(text) == expected
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("100%", "100%"),       # Nothing after the %
+    ("100%4", "100%4"),     # Only one hex digit
+    ("a%2", "a%2"),
+    ("%+1x", "% 1x"),       # Sign ('+' is already a space)
+    ("%-1x", "%-1x"),
+    ("% 1x", "% 1x"),       # Leading whitespace
+    ("%zz", "%zz"),
+    ("%4%41", "%4A"),
+])
+def test_url_decode_keeps_malformed_escapes(text, expected):
+    assert url_decode(text) == expected
+
+
+def test_job_history_only_forgets_finished_jobs():
+    firmware = firmware_names("JOB_QUEUED", "JOB_RUNNING", "JOB_DONE", "JOB_CANCELLED", "_forget_finished_job")
+    job_states = firmware["job_states"] = {1: "running", 2: "queued", 3: "done", 4: "queued", 5: "cancelled"}
+    forget = firmware["_forget_finished_job"]
+
+    assert forget() is True
+    assert forget() is True
+    assert job_states == {1: "running", 2: "queued", 4: "queued"}
+    assert forget() is False
+    assert job_states == {1: "running", 2: "queued", 4: "queued"}
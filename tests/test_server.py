@@ -0,0 +1,31 @@
+"""Tests for the MCP server's device helpers (no ESP32 or simulator required)."""
+
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "server"))
+
+import esp32_mcp_server as server  # noqa: E402
+
+
+@pytest.fixture
+def device():
+    device = server.registry.add("test-board", "127.0.0.1", 9)
+    yield device
+    server.registry.remove("test-board")
+
+
+def test_call_esp32_short_circuits_when_breaker_is_open(device, monkeypatch):
+    for _ in range(server.BREAKER_THRESHOLD):
+        device.breaker.record_failure()
+    assert device.breaker.state == server.CircuitBreaker.OPEN
+
+    def no_request():
+        raise AssertionError("call_esp32 contacted a device whose circuit is open")
+    monkeypatch.setattr(device, "session", no_request)
+
+    result = server.call_esp32("led/on", "test-board")
+    assert result["success"] is False
+    assert "circuit open" in result["error"]